@@ -1,15 +1,24 @@
 from functools import partial
+import functools
+import heapq
+import itertools
+import operator
 import re
+import threading
 
 from .grammar import OMeta
+from . import ir
+from . import schema as schemas
 
 import collections
+import collections.abc
 
 import datetime
 import time
 import json
 import math
 import os
+import urllib.parse
 
 handlebars_grammar = r"""
 template ::= (<text> | <templatecommand>)*:body => ['template'] + body
@@ -57,38 +66,6 @@ blockrule ::= <start> '#' <block_inner>:i
 alttemplate ::= (<start> <alt_inner> <template>)?:alt_t => alt_t or []
 """
 
-compile_grammar = """
-compile ::= <prolog> <rule>* => builder.finish()
-prolog ::= "template" => builder.start()
-compile_block ::= <prolog_block> <rule>* => builder.finish_block()
-prolog_block ::= "template" => builder.start_block()
-rule ::= <literal>
-    | <expand>
-    | <escapedexpand>
-    | <comment>
-    | <block>
-    | <invertedblock>
-    | <partial>
-block ::= [ "block" <anything>:symbol [<arg>*:arguments] [<compile_block>:t] [<compile_block>?:alt_t] ] => builder.add_block(symbol, arguments, t, alt_t)
-comment ::= [ "comment" ]
-literal ::= [ "literal" :value ] => builder.add_literal(value)
-expand ::= [ "expand" <path>:value [<arg>*:arguments]] => builder.add_expand(value, arguments)
-escapedexpand ::= [ "escapedexpand" <path>:value [<arg>*:arguments]] => builder.add_escaped_expand(value, arguments)
-invertedblock ::= [ "invertedblock" <anything>:symbol [<arg>*:arguments] [<compile>:t] ] => builder.add_invertedblock(symbol, arguments, t)
-partial ::= ["partial" <anything>:symbol [<arg>*:arguments]] => builder.add_partial(symbol, arguments)
-path ::= [ "path" [<pathseg>:segment]] => ("simple", segment)
- | [ "path" [<pathseg>+:segments] ] => ("complex", 'resolve(context, "'  + '","'.join(segments) + '")' )
-simplearg ::= [ "path" [<pathseg>+:segments] ] => 'resolve(context, "'  + '","'.join(segments) + '")'
-    | [ "literalparam" <anything>:value ] => str(value)
-arg ::= [ "kwparam" <anything>:symbol <simplearg>:a ] => str(symbol) + '=' + a
-    | <simplearg>
-pathseg ::= "/" => ''
-    | "." => ''
-    | "" => ''
-    | "this" => ''
-pathseg ::= <anything>:symbol => ''.join(symbol)
-"""
-compile_grammar = compile_grammar.format()
 
 class strlist(list):
 
@@ -98,55 +75,222 @@ class strlist(list):
     def grow(self, thing):
         if type(thing) == str:
             self.append(thing)
+        elif isinstance(thing, str):
+            self.append(str(thing))
         else:
             for element in thing:
                 self.grow(element)
 
-_map = {
-    '&': '&amp;',
-    '"': '&quot;',
-    "'": '&#x27;',
-    '`': '&#x60;',
-    '<': '&lt;',
-    '>': '&gt;',
+class SafeString(str):
+    """
+    A string that is already safe for HTML. Helpers can return it to have
+    their output inserted by {{...}} without being escaped again.
+    """
+
+    def __html__(self):
+        return self
+
+Markup = SafeString
+
+# values whose str() never contains characters that need escaping
+_no_escape_types = (int, float, bool)
+
+def escape(something):
+    # chained str.replace was measured faster than both the old re.sub
+    # with a callback and str.translate, with or without special chars
+    cls = type(something)
+    if cls is not str:
+        if cls in _no_escape_types:
+            return str(something)
+        if cls is strlist:
+            return something
+        html = getattr(cls, "__html__", None)
+        if html is not None:
+            return str(html(something))
+        something = str(something)
+    return (something.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            .replace('"', "&quot;").replace("'", "&#x27;").replace("`", "&#x60;"))
+
+def escape_json(something):
+    # for values inside a JSON string literal; __html__ (SafeString) only
+    # means safe for HTML, so it is escaped like any other value
+    cls = type(something)
+    if cls is bool:
+        return "true" if something else "false"
+    if cls in _no_escape_types or cls is strlist:
+        return escape(something)
+    return json.dumps(str(something), ensure_ascii=False)[1:-1]
+
+def escape_url(something):
+    # for values inside a URL component, SafeString included
+    cls = type(something)
+    if cls is strlist:
+        return something
+    return urllib.parse.quote(str(something), safe="")
+
+# escaping function called by {{...}} for each autoescape mode, None
+# inserts the value as is
+escape_functions = {
+    "html": "escape",
+    "json": "escape_json",
+    "url": "escape_url",
+    "none": None,
 }
 
-def substitute(match, _map=_map):
-    return _map[match.group(0)]
+_autoescape_extensions = {
+    ".hbs": "html",
+    ".handlebars": "html",
+    ".html": "html",
+    ".htm": "html",
+    ".xml": "html",
+    ".svg": "html",
+    ".txt": "none",
+    ".text": "none",
+    ".csv": "none",
+    ".tsv": "none",
+    ".md": "none",
+    ".json": "json",
+}
+
+def autoescape_for(file_path):
+    """
+    Autoescape mode inferred from the file extension. For "name.txt.hbs"
+    the inner extension decides.
+    """
+    root, ext = os.path.splitext(file_path.lower())
+    inner = os.path.splitext(root)[1]
+    if ext in (".hbs", ".handlebars") and inner in _autoescape_extensions:
+        ext = inner
+    return _autoescape_extensions.get(ext, "html")
+
+def _get_index(context, key):
+    try:
+        return context[key]
+    except (IndexError, KeyError, TypeError):
+        return None
+
+# names of the declared data fields by class, see _get_attribute()
+_data_fields = {}
+
+def _fields_of(cls):
+    fields = _data_fields.get(cls)
+    if fields is None:
+        fields = set(getattr(cls, "__dataclass_fields__", ()))
+        fields.update(getattr(cls, "_fields", ()))
+        for klass in cls.__mro__:
+            slots = klass.__dict__.get("__slots__", ())
+            fields.update((slots,) if isinstance(slots, str) else slots)
+        _data_fields[cls] = fields = frozenset(fields)
+    return fields
+
+def _get_attribute(context, key):
+    """
+    Public data attributes only: names starting with "_" are hidden, and
+    so are callables (methods, which the generated code would call) that
+    are not a declared field of a dataclass, __slots__ class or
+    namedtuple.
+    """
+    if type(key) is int:
+        return _get_index(context, key)
+    if key.startswith("_"):
+        return None
+    value = getattr(context, key, None)
+    if callable(value) and key not in _fields_of(type(context)):
+        return None
+    return value
+
+# access strategy per context class: mapping (.get), index or attribute
+_getters = {}
+
+def _getter_for(cls):
+    getter = _getters.get(cls)
+    if getter is not None:
+        return getter
+    if cls in (list, tuple):
+        getter = _get_index
+    elif callable(getattr(cls, "get", None)):
+        getter = cls.get
+    elif issubclass(cls, (list, tuple)) and not hasattr(cls, "_fields"):
+        getter = _get_index
+    else:
+        # dataclasses, __slots__ classes, namedtuples, ORM rows...
+        getter = _get_attribute
+    _getters[cls] = getter
+    return getter
+
+class ScopeData:
+    """
+    One frame of @data variables. Frames are chained to the frame of the
+    enclosing scope and never modify it, so a block's @variables don't leak
+    into its siblings.
+    """
+    __slots__ = ('vars', 'parent')
+
+    def __init__(self, vars, parent=None):
+        self.vars = vars
+        self.parent = parent
 
-_escape_re = re.compile(r"&|\"|'|`|<|>")
+    def get(self, name, default=None):
+        frame = self
+        while frame is not None:
+            vars = frame.vars
+            if name in vars:
+                return vars[name]
+            frame = frame.parent
+        return default
 
-def escape(something, _escape_re=_escape_re, substitute=substitute):
-    return _escape_re.sub(substitute, something)
+_no_data = ScopeData({})
 
 class Scope:
+    __slots__ = ('context', 'parent', 'data', 'root')
 
     def __init__(self, context, parent, data=None):
         self.context = context
         self.parent = parent
-        if parent and isinstance(parent,Scope):
-            self.data=parent.data
+        if isinstance(parent, Scope):
+            self.root = parent.root
+            parent_data = parent.data
         else:
-            self.data={}
+            self.root = context if parent is None else parent
+            parent_data = _no_data
         if data:
-            self.data.update(data)
+            if type(data) is not ScopeData:
+                data = ScopeData(data, parent_data)
+            self.data = data
+        else:
+            self.data = parent_data
 
     def get(self, name, default=None):
-        if name == '__parent':
-            return self.parent
-        elif name == 'this':
-            return self.context
-        elif name.startswith("@"):
-            return self.data.get(name[1:])
-        result = self.context.get(name, self)
-        if result is not self:
-            return result
-        return default
+        # '..', 'this', '@root' and '@data' are resolved by the compiler
+        context = self.context
+        result = _getter_for(type(context))(context, name)
+        if result is None:
+            return default
+        return result
     __getitem__ = get
+    # __getitem__ never raises IndexError: iterating a Scope would not end
+    __iter__ = None
 
     def __str__(self):
         return str(self.context)
 
+def scope_parent(scope, depth=1):
+    for i in range(depth):
+        if not isinstance(scope, Scope):
+            return None
+        scope = scope.parent
+    return scope
+
+def scope_root(scope):
+    if isinstance(scope, Scope):
+        return scope.root
+    return scope
+
+def scope_data(scope, name):
+    if isinstance(scope, Scope):
+        return scope.data.get(name)
+    return None
+
 def resolve(context, *segments):
     # print("resolve",segments)
     for segment in segments:
@@ -154,30 +298,68 @@ def resolve(context, *segments):
             return None
         if segment in (None, ""):
             continue
-        if type(context) in (list, tuple):
-            offset = int(segment)
-            try:
-                context = context[offset]
-            except:
-                context = None
-        else:
-            if isinstance(segment, str) and segment.isdigit():
-                segment = int(segment)
-            context = context.get(segment)
+        if isinstance(segment, str) and segment.isdigit():
+            segment = int(segment)
+        context = _getter_for(type(context))(context, segment)
     return context
 
+class Accessor:
+    """
+    Compiled lookup of a fixed path, one per call site in the generated
+    code. Numeric segments are converted once, and for every segment the
+    getter is cached by container type (up to max_types types per
+    segment, other types are resolved on every call).
+    """
+    __slots__ = ('path', 'steps')
+    max_types = 4
+
+    def __init__(self, *segments):
+        self.path = segments
+        self.steps = tuple(
+            (int(segment) if segment.isdigit() else segment, {})
+            for segment in segments)
+
+    def __call__(self, context):
+        for key, cache in self.steps:
+            if context is None:
+                return None
+            cls = type(context)
+            try:
+                getter = cache[cls]
+            except KeyError:
+                getter = _getter_for(cls)
+                if len(cache) < self.max_types:
+                    cache[cls] = getter
+            context = getter(context, key)
+        return context
+
+    def __repr__(self):
+        return "Accessor(%s)" % ", ".join(map(repr, self.path))
+
+_offset_re = re.compile(r"&offset=\d+")
+
 def _paginate(this, options, data, limit=None, offset=None, url=None):
-    if not data:
+    """
+    data is either a sequence or a lazy source with count() and
+    fetch(offset, limit) methods, of which only the current page is fetched.
+    """
+    lazy = callable(getattr(data, "fetch", None))
+    if lazy:
+        count = data.count()
+    elif data:
+        count = len(data)
+    else:
+        count = 0
+    if not count:
         return options['inverse'](this)
     if limit is None:
         limit = 10
     if offset is None:
         offset = 0
-    count = len(data)
     page_no = math.floor(offset / limit) + 1
     num_pages = math.floor((count + limit - 1) / limit)
     paginate = {
-        "data": data[offset:offset + limit],
+        "data": data.fetch(offset, limit) if lazy else data[offset:offset + limit],
         "limit": limit,
         "offset": offset,
         "count": count,
@@ -188,7 +370,7 @@ def _paginate(this, options, data, limit=None, offset=None, url=None):
         "parts": [],
     }
     if url:
-        base_url = re.sub("&offset=\d+", "", url)  # XXX
+        base_url = _offset_re.sub("", url)  # XXX
     else:
         base_url = ""
     if base_url.find("?")==-1: # XXX
@@ -221,31 +403,143 @@ def _paginate(this, options, data, limit=None, offset=None, url=None):
     scope = Scope({"paginate": paginate}, this)
     return options['fn'](scope)
 
-def _each(this, options, context, order=None, offset=None, limit=None):
+_order_specs = {}
+
+def _parse_order(order):
+    """
+    "price desc, name" -> (('price', True), ('name', False)), parsed once
+    per distinct order string.
+    """
+    spec = _order_specs.get(order)
+    if spec is None:
+        spec = []
+        for part in order.split(","):
+            words = part.split()
+            if words:
+                spec.append((words[0], len(words) > 1 and words[1].lower() == "desc"))
+        spec = tuple(spec)
+        if len(_order_specs) > 256:
+            _order_specs.clear()
+        _order_specs[order] = spec
+    return spec
+
+def _sort_key(spec, pairs=False):
+    # pairs: items are (key, value) tuples of a mapping, sort by value
+    names = [name for name, reverse in spec]
+    if len(names) == 1:
+        name = names[0]
+        def key(item):
+            if pairs:
+                item = item[1]
+            return _getter_for(type(item))(item, name)
+    else:
+        def key(item):
+            if pairs:
+                item = item[1]
+            getter = _getter_for(type(item))
+            return tuple(getter(item, name) for name in names)
+    return key
+
+def _sort_items(context, spec, count=None, pairs=False):
+    """
+    Stable sort of context by spec. When only the first count items are
+    needed they are picked with a heap instead of sorting everything.
+    """
+    if len(set(reverse for name, reverse in spec)) == 1:
+        key = _sort_key(spec, pairs)
+        reverse = spec[0][1]
+    else:
+        # mixed directions: compare key by key
+        keys = [(_sort_key([(name, reverse)], pairs), reverse) for name, reverse in spec]
+        def compare(a, b):
+            for key, reverse in keys:
+                ka, kb = key(a), key(b)
+                if ka != kb:
+                    return (ka > kb) - (ka < kb) if not reverse else (ka < kb) - (ka > kb)
+            return 0
+        key = functools.cmp_to_key(compare)
+        reverse = False
+    if count is not None:
+        if reverse:
+            return heapq.nlargest(count, context, key=key)
+        return heapq.nsmallest(count, context, key=key)
+    return sorted(context, key=key, reverse=reverse)
+
+def _sorted_view(options, version, order, spec, count, context, pairs=False):
+    """
+    Sorted view of context for {{#each ... cache_sort=version}}: reused by
+    the renders of the same call site (options['site']) passing the same
+    version, order and limit, so version must change whenever the items do.
+    """
+    env = options.get('environment')
+    if env is None:
+        from . import template
+        env = template.default_environment
+    key = (options.get('site'), version, order, count, pairs)
+    view = env._sorted_views.get(key)
+    if view is None:
+        view = _sort_items(context.items() if pairs else context, spec, count, pairs)
+        env._sorted_views.set(key, view)
+    return view
+
+def _each(this, options, context, order=None, offset=None, limit=None, cache_sort=None):
+    """
+    Iterates lists, any other iterable (consumed lazily, so generators and
+    cursors are never materialised unless sorted) or mappings. Sets the
+    @index, @first and @last data variables, and @key for mappings.
+    cache_sort is a version of the items, see _sorted_view().
+    """
+    # {{#each this}}: iterate the context, not its scope
+    while type(context) is Scope:
+        context = context.context
     if not context:
         return None
     result = strlist()
-    i = 0
+    pairs = isinstance(context, collections.abc.Mapping)
     if order:
-        if len(order.split(" ")) == 2:
-            if order.split(" ")[1] == "desc":
-                context2 = sorted(context, key=lambda x: x[order.split(" ")[0]])[::-1]
+        spec = _parse_order(order)
+        count = (offset or 0) + limit if limit else None
+        if cache_sort is True:
+            raise Exception("cache_sort takes a version of the items, not true")
+        if cache_sort is not None and cache_sort is not False:
+            items = _sorted_view(options, cache_sort, order, spec, count, context, pairs)
         else:
-            context2 = sorted(context, key=lambda x: x[order])
+            items = _sort_items(context.items() if pairs else context, spec, count, pairs)
     else:
-        context2 = context
+        items = context.items() if pairs else context
+    items = iter(items)
     if offset:
-        context2=context2[offset:]
+        items = itertools.islice(items, offset, None)
     if limit:
-        context2=context2[:limit]
-    for ctx in context2:
-        scope = Scope(ctx, this, {})
-        result.grow(options['fn'](scope))
-        i += 1
-    return result
+        items = itertools.islice(items, limit)
+    # one item of lookahead to know which one is @last
+    for item in items:
+        break
+    else:
+        return result
+    fn = options['fn']
+    # the data frame is updated in place: each item's scope is only used
+    # while its block renders
+    data = {"index": 0, "first": True, "last": False}
+    frame = ScopeData(data, this.data if isinstance(this, Scope) else _no_data)
+    index = 0
+    while True:
+        try:
+            next_item = next(items)
+        except StopIteration:
+            data["last"] = True
+        if pairs:
+            data["key"], item = item
+        result.grow(fn(Scope(item, this, frame)))
+        if data["last"]:
+            return result
+        item = next_item
+        index += 1
+        data["index"] = index
+        data["first"] = False
 
 def _if(this, options, context):
-    if isinstance(context, collections.Callable):
+    if callable(context):
         context = context(this)
     if context:
         return options['fn'](this)
@@ -257,12 +551,12 @@ def _unless(this, options, context):
         return options['fn'](this)
 
 def _blockHelperMissing(this, options, context):
-    if isinstance(context, collections.Callable):
+    if callable(context):
         context = context(this)
     if context != "" and not context:
         return options['inverse'](this)
     if type(context) in (list, strlist, tuple):
-        return _each(this, options)
+        return _each(this, options, context)
     if context is True:
         callwith = this
     else:
@@ -281,26 +575,22 @@ def _with(this, options, context):
     else:
         return options['inverse'](this)
 
+_compare_operators = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<=": operator.le,
+    ">=": operator.ge,
+    "<": operator.lt,
+    ">": operator.gt,
+    "in": lambda val1, val2: val1 in val2,
+    "not in": lambda val1, val2: val1 not in val2,
+}
+
 def _compare(this, options, val1, val2, operator="="):
-    if operator == "=":
-        res = val1 == val2
-    elif operator == "!=":
-        res = val1 == val2
-    elif operator == "<=":
-        res = val1 <= val2
-    elif operator == ">=":
-        res = val1 >= val2
-    elif operator == "<":
-        res = val1 < val2
-    elif operator == ">":
-        res = val1 > val2
-    elif operator == "in":
-        res = val1 in val2
-    elif operator == "not in":
-        res = val1 not in val2
-    else:
+    test = _compare_operators.get(operator)
+    if test is None:
         raise Exception("Invalid operator: '%s'" % operator)
-    if res:
+    if test(val1, val2):
         return options['fn'](this)
     else:
         return options['inverse'](this)
@@ -339,88 +629,472 @@ def _if_match(this, options, val, pattern):
     else:
         return options['inverse'](this)
 
+class _Dynamic(object):
+    # stands for the arguments that are not literals in specialise hooks
+    def __repr__(self):
+        return "DYNAMIC"
+
+DYNAMIC = _Dynamic()
+
+def _specialise_compare(val1, val2, operator="="):
+    test = _compare_operators.get(operator)
+    if test is None:
+        return None
+    def compare(this, options, val1, val2, operator=None):
+        if test(val1, val2):
+            return options['fn'](this)
+        return options['inverse'](this)
+    return compare
+
+def _specialise_ifeq(val1, val2):
+    if val1 is DYNAMIC or val2 is DYNAMIC:
+        return None
+    branch = 'fn' if val1 == val2 else 'inverse'
+    def ifeq(this, options, val1, val2):
+        return options[branch](this)
+    return ifeq
+
+def _specialise_if_match(val, pattern):
+    if type(pattern) is not str:
+        return None
+    try:
+        regex = re.compile(pattern.replace("%", ".*"))
+    except re.error:
+        # left to the generic helper, which only fails if the block renders
+        return None
+    def if_match(this, options, val, pattern):
+        if regex.match(val or ""):
+            return options['fn'](this)
+        return options['inverse'](this)
+    return if_match
+
+class TTLCache:
+    """
+    In-memory fragment cache backend: LRU of maxsize entries, each expiring
+    ttl seconds after it was set (never when ttl is None). Other backends
+    only need the same get(key) and set(key, value, ttl) methods.
+    """
+
+    def __init__(self, maxsize=1024, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= self.clock():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = None if ttl is None else self.clock() + ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+def _cache(this, options, key, *args, ttl=None):
+    """
+    {{#cache "nav" user.id ttl=60}}...{{/cache}}: the rendered block is
+    stored under the key plus any extra arguments in the fragment cache of
+    the rendering environment; a hit skips the body.
+    """
+    if args:
+        key = ":".join([str(key)] + [str(arg) for arg in args])
+    env = options.get('environment')
+    if env is None:
+        from . import template
+        env = template.default_environment
+    value = env.fragment_cache.get(key)
+    if value is not None:
+        env._fragment_stats["hits"] += 1
+        return value
+    env._fragment_stats["misses"] += 1
+    value = options['fn'](this)
+    value = "" if value is None else str(value)
+    env.fragment_cache.set(key, value, ttl)
+    return value
+
+builtin_helpers = {
+    'blockHelperMissing': _blockHelperMissing,
+    'each': _each,
+    'if': _if,
+    'helperMissing': _helperMissing,
+    'unless': _unless,
+    'with': _with,
+    'compare': _compare,
+    'ifeq': _ifeq,
+    'if_match': _if_match,
+    'paginate': _paginate,
+    'cache': _cache,
+}
+
+# compile-time hooks: called with the literal arguments of a call site
+# (DYNAMIC for the others), they return a callable that replaces the
+# helper at that call site, or None
+builtin_specialisers = {
+    'compare': _specialise_compare,
+    'ifeq': _specialise_ifeq,
+    'if_match': _specialise_if_match,
+}
+
 _globals_ = {
-    'helpers': {
-        'blockHelperMissing': _blockHelperMissing,
-        'each': _each,
-        'if': _if,
-        'helperMissing': _helperMissing,
-        'unless': _unless,
-        'with': _with,
-        'compare': _compare,
-        'ifeq': _ifeq,
-        'if_match': _if_match,
-    },
+    'helpers': dict(builtin_helpers),
+    'specialisers': dict(builtin_specialisers),
 }
 
-def register_helper(name,func):
-    _globals_["helpers"][name]=func
+# per-render memo tables of the pure helpers, see begin_render()
+_render_state = threading.local()
+
+def begin_render():
+    state = _render_state
+    depth = getattr(state, "depth", 0)
+    if not depth:
+        state.memo = {}
+    state.depth = depth + 1
+
+def end_render():
+    state = _render_state
+    state.depth -= 1
+    if not state.depth:
+        state.memo = None
+
+class MemoizedHelper:
+    """
+    Wrapper of a pure helper: results are memoised by the (hashable)
+    arguments, either for the duration of one render (cache="render") or
+    across renders in a bounded LRU (cache="global"). The helper must not
+    depend on `this`. Calls with unhashable arguments are not cached.
+    """
+
+    def __init__(self, func, cache="render", maxsize=128):
+        if cache not in ("render", "global"):
+            raise Exception("Invalid helper cache: '%s'" % cache)
+        self.func = func
+        self.cache = cache
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lru = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, this, *args, **kwargs):
+        # types are part of the key: 1, 1.0 and True are equal but may
+        # not format the same
+        key = args + tuple(map(type, args))
+        if kwargs:
+            key += (frozenset(kwargs.items()),)
+        try:
+            hash(key)
+        except TypeError:
+            return self.func(this, *args, **kwargs)
+        if self.cache == "render":
+            memo = getattr(_render_state, "memo", None)
+            if memo is None:
+                return self.func(this, *args, **kwargs)
+            table = memo.get(self)
+            if table is None:
+                table = memo[self] = {}
+            if key in table:
+                self.hits += 1
+                return table[key]
+            self.misses += 1
+            value = table[key] = self.func(this, *args, **kwargs)
+            return value
+        with self._lock:
+            if key in self._lru:
+                self.hits += 1
+                self._lru.move_to_end(key)
+                return self._lru[key]
+        self.misses += 1
+        value = self.func(this, *args, **kwargs)
+        with self._lock:
+            self._lru[key] = value
+            if self.maxsize is not None and len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+        return value
+
+    def cache_info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._lru),
+            "maxsize": self.maxsize,
+            "cache": self.cache,
+        }
+
+    def cache_clear(self):
+        with self._lock:
+            self._lru.clear()
+        self.hits = self.misses = 0
+
+def register_helper(name, func, pure=False, cache="render", maxsize=128, specialise=None):
+    # the helper table is the default environment's, which also drops the
+    # templates compiled against the previous helper of that name
+    from . import template
+    template.default_environment.register_helper(name, func, pure, cache, maxsize, specialise)
+
+def helper_cache_info(name):
+    helper = _globals_["helpers"].get(name)
+    if not isinstance(helper, MemoizedHelper):
+        return None
+    return helper.cache_info()
 
 def get_helpers():
     return _globals_["helpers"]
 
+def get_specialisers():
+    return _globals_["specialisers"]
+
+_not_a_helper = object()
+
+def specialise_helper(helpers, specialisers, name, args, kwargs):
+    """
+    (helper, replacement) for a call site of the helper name with the
+    given literal arguments. The replacement is used only while the
+    helper found at render time is still this helper.
+    """
+    helper = helpers.get(name)
+    if helper is None:
+        return _not_a_helper, None
+    hook = specialisers.get(name)
+    special = None
+    if hook is not None:
+        try:
+            special = hook(*args, **kwargs)
+        except Exception:
+            # e.g. the wrong number of arguments: the helper itself raises
+            # when (and only if) the call site renders
+            special = None
+    return helper, special or helper
+
 class CodeBuilder:
+    """
+    Generates the Python source of a template from its IR (see pyhbs.ir),
+    one function per block.
+    """
 
-    def __init__(self):
+    def __init__(self, autoescape="html", specialisers=None, helpers=None, schema=None,
+                 guard_stats=False):
+        if autoescape not in escape_functions:
+            raise Exception("Invalid autoescape mode: '%s'" % autoescape)
         self.stack = []
         self.blocks = {}
+        self.autoescape = autoescape
+        self.constants = strlist()
+        self.constants.grow("autoescape = %r\n" % autoescape)
+        self.specialisers = _globals_["specialisers"] if specialisers is None else specialisers
+        self.specialised = []
+        self.helpers = _globals_["helpers"] if helpers is None else helpers
+        # context schema of the function being generated, see enter_block()
+        self.schema = schema
+        self.schema_types = schema.types() if schema is not None else ()
+        self.guard_stats = guard_stats
+        self.schemas = []
+        self.block_schema = None
+        self.inverse_schemas = []
+        self.path_names = {}
+        self.inline_count = 0
+        # names the generated code depends on, see template.invalidate()
+        self.dependencies = {"partials": set(), "helpers": set()}
+        self._emitters = {
+            ir.Literal: self.add_literal,
+            ir.Lookup: self.add_lookup,
+            ir.HelperCall: self.add_lookup,
+            ir.Block: self.add_block,
+            ir.Loop: self.add_block,
+            ir.InvertedBlock: self.add_invertedblock,
+            ir.Branch: self.add_branch,
+            ir.Partial: self.add_partial,
+        }
+
+    def generate(self, nodes):
+        self.start()
+        self.add_nodes(nodes)
+        return self.finish()
+
+    def add_nodes(self, nodes):
+        for node in nodes:
+            self._emitters[type(node)](node)
 
     def start(self):
         self._result = strlist()
         self.stack.append((self._result, "render"))
         self._result.grow("def render(context, helpers=None, partials=None):\n")
         self._result.grow("    result = strlist()\n")
-        self._result.grow("    _helpers = dict(_globals_['helpers'])\n")
-        self._result.grow("    if helpers is not None: _helpers.update(helpers)\n")
-        self._result.grow("    helpers = _helpers\n")
+        # helpers passed at render time are merged into the bound table
+        # once, here, and handed down to the blocks as they are
+        self._result.grow("    if helpers is None: helpers = bound_helpers\n")
+        self._result.grow("    elif helpers is not bound_helpers: helpers = dict(bound_helpers, **helpers)\n")
         self._result.grow("    if partials is None: partials = {}\n")
+        self.schemas.append(self.schema)
+        self._schema_guard()
 
     def finish(self):
         self._result.grow("    return result\n")
-        source = "from pyhbs.hbs_compiler import strlist,escape,Scope,partial,_globals_,resolve\n\n"
+        source = "from pyhbs.hbs_compiler import strlist,escape,escape_json,escape_url,Scope,partial,_globals_,resolve,scope_parent,scope_root,scope_data,Accessor,DYNAMIC,specialise_helper,builtin_helpers\n\n"
+        source += "from pyhbs.template import get_partial\n\n"
+        source += "".join(self.constants)
+        # classes of the schema guards, set by Environment
+        source += "schema_types = %r\n" % ((None,) * len(self.schema_types),)
+        # set by Environment too, None renders with the default one
+        source += "environment = None\n"
+        if self.guard_stats:
+            source += "guard_stats = [0, 0]\n"
+        source += self.bind_function()
+        source += "dependencies = %r\n\n" % dict(
+            (kind, sorted(names)) for kind, names in sorted(self.dependencies.items()))
         for name, lines in reversed(sorted(self.blocks.items())):
             source += "".join(lines) + "\n"
         lines = self._result
         source += "".join(lines)
         return source
 
-    def start_block(self):
+    def bind_function(self):
+        # called again by Environment with its own helper table
+        names = ["bound_helpers"] + [name for name, call in self.specialised]
+        lines = ["def bind(helpers, specialisers):\n",
+                 "    global %s\n" % ", ".join(names),
+                 "    bound_helpers = helpers\n"]
+        for name, call in self.specialised:
+            lines.append("    %s = specialise_helper(helpers, specialisers, %s)\n" % (name, call))
+        lines.append("bind(_globals_['helpers'], _globals_['specialisers'])\n\n")
+        return "".join(lines)
+
+    def specialise(self, symbol, args, kwargs):
+        """
+        Name of the (helper, replacement) pair of this call site when
+        the helper has a specialise hook and some arguments are literals.
+        """
+        if symbol not in self.specialisers:
+            return None
+        values = [arg.value if isinstance(arg, ir.Const) else DYNAMIC for arg in args]
+        named = dict((key, arg.value if isinstance(arg, ir.Const) else DYNAMIC)
+                     for key, arg in kwargs)
+        if not any(isinstance(arg, ir.Const) for arg in list(args) + [v for k, v in kwargs]):
+            return None
+        name = "_special%d" % len(self.specialised)
+        self.specialised.append((name, "%r, %r, %r" % (symbol, tuple(values), named)))
+        return name
+
+    def start_block(self, schema=None, hoisted=False):
         name = "render_block%d" % len(self.blocks)
         self._result = strlist()
         self.blocks[name] = self._result
         self.stack.append((self._result, name))
-        self._result.grow("def %s(context, helpers=None, partials=None):\n" % name)
+        if hoisted:
+            # the values of the loop invariant lookups, see ir.hoist_lookups
+            self._result.grow("def %s(context, helpers=None, partials=None, hoisted=None):\n" % name)
+        else:
+            self._result.grow("def %s(context, helpers=None, partials=None):\n" % name)
         self._result.grow("    result = strlist()\n")
-        self._result.grow("    _helpers = dict(_globals_['helpers'])\n")
-        self._result.grow("    if helpers is not None: _helpers.update(helpers)\n")
-        self._result.grow("    helpers = _helpers\n")
+        self._result.grow("    if helpers is None: helpers = bound_helpers\n")
         self._result.grow("    if partials is None: partials = {}\n")
+        self.schemas.append(schema)
+        self._schema_guard()
+
+    def _schema_guard(self):
+        # lookups of declared fields read ctx directly while typed is true,
+        # see typed_read()
+        schema = self.schemas[-1]
+        if schema is None:
+            return None
+        if schema.kind == "mapping":
+            cls = "dict"
+        else:
+            cls = "schema_types[%d]" % self.schema_types.index(schema.cls)
+        self._result.grow([
+            "    ctx = context\n",
+            "    while type(ctx) is Scope: ctx = ctx.context\n",
+            "    typed = type(ctx) is %s and helpers is bound_helpers\n" % cls])
+        if self.guard_stats:
+            # [generic, typed] calls of the guarded functions
+            self._result.grow("    guard_stats[typed] += 1\n")
 
     def finish_block(self):
         self._result.grow("    return result\n")
+        self.schemas.pop()
         name = self.stack.pop(-1)[1]
         self._result = self.stack and self.stack[-1][0]
         return name
 
-    def add_block(self, symbol, arguments, name, alt_name):
-        call = self.arguments_to_call(arguments)
+    def add_function(self, nodes, schema=None, hoisted=False):
+        # name of a new block function rendering nodes
+        self.start_block(schema, hoisted)
+        self.add_nodes(nodes)
+        return self.finish_block()
+
+    def add_block(self, node):
+        arguments = self.arguments(node)
+        call = ", ".join(arguments) + ")"
+        special = self.specialise(node.name, node.args, node.kwargs) if node.bound else None
+        # context schemas of the blocks; the built-in helpers render
+        # {{else}} in their own context
+        schema = self.schemas[-1]
+        if self.helpers.get(node.name) is not builtin_helpers.get(node.name):
+            schema = None
+        block_schema = None
+        if schema is not None:
+            names = self.path_names.get(arguments[0]) if node.args else None
+            block_schema = schemas.block_schema(node.name, names, schema)
+        hoisted = getattr(node, "hoisted", None)
+        name = self.add_function(node.body, block_schema, bool(hoisted))
+        alt_name = None
+        if node.inverse is not None:
+            alt_name = self.add_function(node.inverse, schema)
         self._result.grow([
             "    options = {'fn': %s}\n" % name,
             "    options['helpers'] = helpers\n"
             "    options['partials'] = partials\n"
+            "    options['environment'] = environment\n"
         ])
+        if any(key == "cache_sort" for key, arg in node.kwargs):
+            # identity of the call site, see _sorted_view()
+            site = "_site%d" % len(self.constants)
+            self.constants.grow("%s = object()\n" % site)
+            self._result.grow("    options['site'] = %s\n" % site)
         if alt_name:
             self._result.grow(["    options['inverse'] = %s\n" % alt_name])
         else:
             self._result.grow([
                 "    options['inverse'] = lambda this: None\n"
             ])
+        self._result.grow("    value = helper = helpers.get('%s')\n" % node.name)
+        if special:
+            self._result.grow([
+                "    if helper is %s[0]:\n" % special,
+                "        value = %s[1]\n" % special,
+                "    el"])
+        else:
+            self._result.grow("    ")
         self._result.grow([
-            "    value = helper = helpers.get('%s')\n" % symbol,
-            "    if value is None:\n"
-            "        value = context.get('%s')\n" % symbol,
+            "if value is None:\n"
+            "        value = context.get('%s')\n" % node.name,
             "    if helper and callable(helper):\n"
-            "        this = Scope(context, context)\n"
+            "        this = Scope(context, context)\n"])
+        if hoisted:
+            # every item is rendered in Scope(item, this): the hoisted
+            # paths are relative to this
+            self._result.grow([
+                "        if helper is builtin_helpers['each']:\n",
+                "            options['fn'] = partial(%s, hoisted=(%s,))\n" % (
+                    name, ", ".join(self.path_expr(path.segments, "this") for path in hoisted))])
+        self._result.grow([
             "        value = value(this, options, %s\n" % call,
             "    else:\n"
             "        helper = helpers['blockHelperMissing']\n"
@@ -429,77 +1103,189 @@ class CodeBuilder:
             "    result.grow(value)\n"
         ])
 
-    def add_literal(self, value):
-        self._result.grow("    result.append(%r)\n" % value)
+    def add_branch(self, node):
+        # what a built-in conditional does when it renders this branch
+        name = self.add_function(node.body, self.schemas[-1])
+        self._result.grow("    result.grow(%s(Scope(context, context)))\n" % name)
 
-    def _lookup_arg(self, arg):
-        if not arg:
-            return "context"
-        return arg
-
-    def arguments_to_call(self, arguments):
-        params = list(map(self._lookup_arg, arguments))
-        return ", ".join(params) + ")"
-
-    def find_lookup(self, path, path_type, call):
-        if path and path_type == "simple":  # simple names can reference helpers.
-            # TODO: compile this whole expression in the grammar; for now,
-            # fugly but only a compile time overhead.
-            # XXX: just rm.
-            realname = path.replace('.get("', '').replace('")', '')
-            self._result.grow([
-                "    value = helpers.get('%s')\n" % realname,
-                "    if value is None:\n"
-                "        value = resolve(context, '%s')\n" % path,
-            ])
-        elif path_type == "simple":
-            realname = None
+    def add_literal(self, node):
+        self._result.grow("    result.append(%r)\n" % node.text)
+
+    def argument(self, arg):
+        if isinstance(arg, ir.Const):
+            return repr(arg.value)
+        if isinstance(arg, ir.Hoisted):
+            # not set when the loop was rendered by another each helper
+            return "(hoisted[%d] if hoisted is not None else %s)" % (
+                arg.index, self.path_expr(arg.segments))
+        return self.path_expr(arg.segments)
+
+    def arguments(self, node):
+        # Python expressions of the arguments of a call
+        params = [self.argument(arg) for arg in node.args]
+        params += ["%s=%s" % (key, self.argument(arg)) for key, arg in node.kwargs]
+        return params
+
+    def path_expr(self, segments, base="context"):
+        """
+        Python expression resolving a path against the current context
+        (or the scope named base). Parent ('..'), '@root' and '@data'
+        segments become direct scope accesses instead of runtime name
+        checks.
+        """
+        expr = base
+        names = []
+        depth = 0
+        for segment in segments:
+            if segment == "__parent":
+                if names:
+                    expr = "resolve(%s, %s)" % (expr, ", ".join(map(repr, names)))
+                    names = []
+                depth += 1
+                continue
+            if depth:
+                expr = "scope_parent(%s, %d)" % (expr, depth)
+                depth = 0
+            if segment.startswith("@") and not names:
+                if segment == "@root":
+                    expr = "scope_root(%s)" % expr
+                else:
+                    expr = "scope_data(%s, %r)" % (expr, segment[1:])
+            elif segment:
+                names.append(segment)
+        if depth:
+            expr = "scope_parent(%s, %d)" % (expr, depth)
+        if names:
+            plain = expr == "context"
+            expr = "%s(%s)" % (self.accessor(names), expr)
+            if plain:
+                typed = self.typed_expr(names)
+                if typed:
+                    expr = "(%s(ctx, context) if typed else %s)" % (
+                        self.typed_read(typed, expr), expr)
+                self.path_names[expr] = tuple(names)
+        elif expr == "context":
+            expr = "resolve(context)"
+        return expr
+
+    def typed_expr(self, names):
+        """
+        Direct access to the declared fields of names in ctx, for the
+        functions whose context has a schema, or None.
+        """
+        schema = self.schemas[-1] if self.schemas else None
+        if schema is None:
+            return None
+        expr, rest = schemas.access(schema, names, "ctx")
+        if len(rest) == len(names):
+            return None
+        if rest:
+            expr = "%s(%s)" % (self.accessor(rest), expr)
+        return expr
+
+    def typed_read(self, typed, generic):
+        """
+        Name of a function returning the typed expression, or the generic
+        one when the context doesn't match the schema after all (a missing
+        required field, None for a nested object...).
+        """
+        name = "_typed%d" % len(self.constants)
+        self.constants.grow([
+            "def %s(ctx, context):\n" % name,
+            "    try:\n",
+            "        return %s\n" % typed,
+            "    except (KeyError, IndexError, TypeError, AttributeError):\n"])
+        if self.guard_stats:
+            self.constants.grow("        guard_stats[0] += 1\n")
+        self.constants.grow("        return %s\n\n" % generic)
+        return name
+
+    def accessor(self, names):
+        name = "_lookup%d" % len(self.constants)
+        self.constants.grow("%s = Accessor(%s)\n" % (name, ", ".join(map(repr, names))))
+        return name
+
+    def add_lookup(self, node):
+        if isinstance(node, ir.HelperCall):
+            name = node.name
+        elif node.path.simple:
+            name = node.path.segments[0]
+        else:
+            name = None
+        if name is not None and (name.startswith("@") or name == "__parent"):
+            name = None
+        if name is None:
+            self._result.grow("    value = %s\n" % self.argument(node.path))
+        elif not name:
+            self._result.grow("    value = resolve(context, '')\n")
+        call = ", ".join(self.arguments(node)) + ")"
+        if name:  # simple names can reference helpers.
+            special = None
+            typed = None
+            if isinstance(node, ir.HelperCall):
+                special = self.specialise(name, node.args, node.kwargs)
+            elif node.field:
+                typed = self.typed_expr([name])
+            start = len(self._result)
+            self._result.grow("    value = helpers.get('%s')\n" % name)
+            if special:
+                self._result.grow([
+                    "    if value is %s[0]:\n" % special,
+                    "        value = %s[1]\n" % special,
+                    "    el"])
+            else:
+                self._result.grow("    ")
             self._result.grow([
-                "    value = resolve(context, '%s')\n" % path,
+                "if value is None:\n"
+                "        value = %s(context)\n" % self.accessor([name]),
             ])
-        else:
-            realname = None
-            self._result.grow("    value = %s\n" % path)
+            if typed:
+                # a declared field that is not a helper: no helper probe,
+                # and the generic lookup if the context doesn't match
+                self._indent_from(start)
+                fallback = [
+                    "    if typed:\n",
+                    "        try:\n",
+                    "            value = %s\n" % typed,
+                    "        except (KeyError, IndexError, TypeError, AttributeError):\n"]
+                if self.guard_stats:
+                    fallback.append("            guard_stats[0] += 1\n")
+                fallback += [
+                    "            value = %s(context)\n" % self.accessor([name]),
+                    "    else:\n"]
+                self._result.insert(start, "".join(fallback))
         self._result.grow([
             "    if callable(value):\n"
             "        this = Scope(context, context)\n"
             "        value = value(this, %s\n" % call,
         ])
-        if realname:
+        if name:
             self._result.grow(
                 "    elif value is None:\n"
                 "        this = Scope(context, context)\n"
                 "        value = helpers.get('helperMissing')(this, '%s', %s\n"
-                % (realname, call)
+                % (name, call)
             )
         self._result.grow("    if value is None: value = ''\n")
-
-    def add_escaped_expand(self, path_type_path, arguments):
-        (path_type, path) = path_type_path
-        call = self.arguments_to_call(arguments)
-        self.find_lookup(path, path_type, call)
-        self._result.grow([
-            "    if type(value) is not strlist:\n",
-            "        value = escape(str(value))\n",
-            "    result.grow(value)\n"
-        ])
-
-    def add_expand(self, path_type_path, arguments):
-        (path_type, path) = path_type_path
-        call = self.arguments_to_call(arguments)
-        self.find_lookup(path, path_type, call)
-        self._result.grow([
-            "    if type(value) is not strlist:\n",
-            "        value = str(value)\n",
-            "    result.grow(value)\n"
-        ])
+        escape_function = escape_functions[self.autoescape]
+        if node.escaped and escape_function is not None:
+            self._result.grow([
+                "    result.grow(%s(value))\n" % escape_function
+            ])
+        else:
+            self._result.grow([
+                "    if type(value) is not strlist:\n",
+                "        value = str(value)\n",
+                "    result.grow(value)\n"
+            ])
 
     def _debug(self):
         self._result.grow("    import pdb;pdb.set_trace()\n")
 
-    def add_invertedblock(self, symbol, arguments, name):
+    def add_invertedblock(self, node):
+        name = self.add_function(node.body)
         self._result.grow([
-            "    value = context.get('%s')\n" % symbol,
+            "    value = context.get('%s')\n" % node.name,
             "    if not value:\n"
             "    "])
         self._invoke_template(name, "context")
@@ -513,32 +1299,130 @@ class CodeBuilder:
             ", helpers=helpers, partials=partials))\n"
         ])
 
-    def add_partial(self, symbol, arguments):
-        if arguments:
-            assert len(arguments) == 1, arguments
-            arg = arguments[0]
+    def _add_inline_partial(self, node):
+        # partials passed at render time still take precedence
+        self._result.grow("    if %r in partials:\n" % node.name)
+        start = len(self._result)
+        self._add_partial_call(node)
+        self._indent_from(start)
+        self._result.grow("    else:\n")
+        start = len(self._result)
+        saved = None
+        if node.arg is not None or ir.uses_parent(node.body):
+            self.inline_count += 1
+            saved = "_context%d" % self.inline_count
+            self._result.grow([
+                "    %s = context\n" % saved,
+                "    context = Scope(%s, context)\n" % self._partial_arg(node)])
+        # ctx is the context of the enclosing function
+        self.schemas.append(None if saved else self.schemas[-1])
+        try:
+            self.add_nodes(node.body)
+        finally:
+            self.schemas.pop()
+        if saved:
+            self._result.grow("    context = %s\n" % saved)
+        if len(self._result) == start:
+            self._result.grow("    pass\n")
+        self._indent_from(start)
+
+    def _indent_from(self, start):
+        lines = "".join(self._result[start:]).splitlines(True)
+        del self._result[start:]
+        self._result.grow(["    " + line for line in lines])
+
+    def add_partial(self, node):
+        if node.body is not None:
+            self._add_inline_partial(node)
         else:
-            arg = ""
+            self._add_partial_call(node)
+
+    def _partial_arg(self, node):
+        if node.arg is None:
+            return "context"
+        return self.argument(node.arg)
+
+    def _add_partial_call(self, node):
         self._result.grow([
-            "    inner = partials['%s']\n" % symbol,
-            "    scope = Scope(%s, context)\n" % self._lookup_arg(arg)])
+            "    inner = partials.get(%r)\n" % node.name,
+            "    if inner is None:\n"
+            "        inner = get_partial(%r)\n" % node.name,
+            "    scope = Scope(%s, context)\n" % self._partial_arg(node)])
         self._invoke_template("inner", "scope")
 
 class Compiler:
     _handlebars = OMeta.makeGrammar(handlebars_grammar, {}, 'handlebars')
-    _builder = CodeBuilder()
-    _compiler = OMeta.makeGrammar(compile_grammar, {'builder': _builder})
 
-    def __init__(self):
+    # partials longer than this (in source characters) are not inlined
+    inline_max_size = 4096
+    inline_max_depth = 4
+
+    def __init__(self, autoescape="html", partial_loader=None, specialisers=None,
+                 helpers=None, schema=None, guard_stats=False, passes=None, dump_ir=None):
+        """
+        partial_loader(name) returns (source, autoescape) of a partial, or
+        None; partials it knows about are inlined into the template.
+        specialisers are the specialise hooks of the helpers by name and
+        helpers the helper table (the global ones by default). With a
+        context schema (see pyhbs.schema), lookups of declared fields read
+        the context directly when it has the declared type; guard_stats
+        counts how often it does. passes are the names of the IR passes
+        run, in order (pyhbs.ir.default_passes by default), and dump_ir a
+        file the IR is written to after each of them.
+        """
         self._helpers = {}
+        self.autoescape = autoescape
+        self.partial_loader = partial_loader
+        self.specialisers = specialisers
+        self.helpers = helpers
+        self.schema = None if schema is None else schemas.as_schema(schema)
+        self.guard_stats = guard_stats
+        self.passes = ir.PassManager(passes, dump_ir)
 
-    def compile(self, source):
-        self._builder.stack = []
-        self._builder.blocks = {}
+    def parse(self, source):
         tree, err = self._handlebars(source).apply('template')
         if err.error:
             raise Exception(err.formatError(source))
-        code, err = self._compiler(tree).apply('compile')
-        if err.error:
-            raise Exception(err.formatError(tree))
-        return code
+        return tree
+
+    def _inline_tree(self, symbol, inlining):
+        """
+        Parse tree of a partial that can be inlined at compile time: its
+        source is known, it is small, it has the same autoescape mode and
+        is not already being inlined (recursion).
+        """
+        if self.partial_loader is None:
+            return None
+        if symbol in inlining or len(inlining) >= self.inline_max_depth:
+            return None
+        found = self.partial_loader(symbol)
+        if found is None:
+            return None
+        source, autoescape = found
+        if autoescape != self.autoescape or len(source) > self.inline_max_size:
+            return None
+        try:
+            return self.parse(source)
+        except Exception:
+            return None
+
+    def build(self, tree, inlining=()):
+        # IR of a parse tree, with the partials that can be inlined
+        def inline(symbol):
+            inner = self._inline_tree(symbol, inlining)
+            if inner is None:
+                return None
+            return self.build(inner, inlining + (symbol,))
+        return ir.from_tree(tree, inline)
+
+    def compile(self, source):
+        nodes = self.build(self.parse(source))
+        dependencies = ir.dependencies(nodes)
+        helpers = _globals_["helpers"] if self.helpers is None else self.helpers
+        nodes = self.passes.run(nodes, helpers)
+        # every compilation gets its own builder so that templates can be
+        # compiled from several threads at once
+        builder = CodeBuilder(self.autoescape, self.specialisers, self.helpers, self.schema,
+                              self.guard_stats)
+        builder.dependencies = dependencies
+        return builder.generate(nodes)
@@ -0,0 +1,177 @@
+"""
+Tree-walking interpreter: renders the parse tree of a template directly,
+with the same Scope and helper semantics as the generated code, so that
+sources rendered only once or twice don't pay for code generation and
+compile().
+"""
+import ast
+
+from . import hbs_compiler
+from . import ir
+from .hbs_compiler import Scope, strlist, resolve, scope_parent, scope_root, scope_data
+
+def _no_inverse(this):
+    return None
+
+class InterpretedTemplate(object):
+    """
+    Same interface as a compiled template: render(context, helpers=None,
+    partials=None) and the dependencies it was built from. uses counts
+    the renders, see Environment.render_source.
+    """
+
+    def __init__(self, tree, autoescape="html", helpers=None, get_partial=None, environment=None):
+        if autoescape not in hbs_compiler.escape_functions:
+            raise Exception("Invalid autoescape mode: '%s'" % autoescape)
+        escape_function = hbs_compiler.escape_functions[autoescape]
+        self.tree = tree
+        self.autoescape = autoescape
+        self.escape = escape_function and getattr(hbs_compiler, escape_function)
+        self.bound_helpers = hbs_compiler.get_helpers() if helpers is None else helpers
+        self.get_partial = get_partial
+        self.environment = environment
+        # identities of the block call sites, by id() of their node
+        self._sites = {}
+        self.uses = 0
+        self.dependencies = dict((kind, sorted(names))
+                                 for kind, names in ir.dependencies(ir.from_tree(tree)).items())
+
+    def render(self, context, helpers=None, partials=None):
+        if helpers is None:
+            helpers = self.bound_helpers
+        elif helpers is not self.bound_helpers:
+            helpers = dict(self.bound_helpers, **helpers)
+        if partials is None:
+            partials = {}
+        return self._render(self.tree, context, helpers, partials)
+
+    def _block(self, tree):
+        def render_block(context, helpers=None, partials=None):
+            if helpers is None:
+                helpers = self.bound_helpers
+            if partials is None:
+                partials = {}
+            return self._render(tree, context, helpers, partials)
+        return render_block
+
+    def _render(self, tree, context, helpers, partials):
+        result = strlist()
+        for node in tree[1:]:
+            kind = node[0]
+            if kind == "literal":
+                result.append(node[1])
+            elif kind == "escapedexpand" or kind == "expand":
+                value = self._expand(node[1][1], node[2], context, helpers)
+                if kind == "escapedexpand" and self.escape is not None:
+                    result.grow(self.escape(value))
+                else:
+                    if type(value) is not strlist:
+                        value = str(value)
+                    result.grow(value)
+            elif kind == "block":
+                result.grow(self._call_block(node, context, helpers, partials))
+            elif kind == "invertedblock":
+                if not context.get(node[1]):
+                    result.grow(self._block(node[3])(context, helpers=helpers, partials=partials))
+            elif kind == "partial":
+                result.grow(self._call_partial(node[1], node[2], context, helpers, partials))
+        return result
+
+    def _expand(self, segments, arguments, context, helpers):
+        segments = [_segment(segment) for segment in segments]
+        name = None
+        if len(segments) == 1 and not segments[0].startswith("@") and segments[0] != "__parent":
+            name = segments[0]
+        if name:
+            value = helpers.get(name)
+            if value is None:
+                value = resolve(context, name)
+        elif name is not None:
+            value = context
+        else:
+            value = _path_value(segments, context)
+        if callable(value):
+            args, kwargs = _arguments(arguments, context)
+            value = value(Scope(context, context), *args, **kwargs)
+        elif value is None and name:
+            args, kwargs = _arguments(arguments, context)
+            value = helpers.get('helperMissing')(Scope(context, context), name, *args, **kwargs)
+        if value is None:
+            value = ''
+        return value
+
+    def _call_block(self, node, context, helpers, partials):
+        symbol, arguments, tree, inverse = node[1:5]
+        options = {'fn': self._block(tree)}
+        options['helpers'] = helpers
+        options['partials'] = partials
+        options['environment'] = self.environment
+        options['site'] = self._sites.setdefault(id(node), object())
+        options['inverse'] = self._block(inverse) if inverse else _no_inverse
+        value = helper = helpers.get(symbol)
+        if value is None:
+            value = context.get(symbol)
+        if helper and callable(helper):
+            args, kwargs = _arguments(arguments, context)
+            value = value(Scope(context, context), options, *args, **kwargs)
+        else:
+            value = helpers['blockHelperMissing'](context, options, value)
+        if value is None:
+            value = ''
+        return value
+
+    def _call_partial(self, symbol, arguments, context, helpers, partials):
+        inner = partials.get(symbol)
+        if inner is None:
+            inner = self.get_partial(symbol)
+        this = _argument(arguments[0], context) if arguments else context
+        return inner(Scope(this, context), helpers=helpers, partials=partials)
+
+def _segment(segment):
+    return '' if segment == "this" else segment
+
+def _path_value(segments, context):
+    # same as the expressions of CodeBuilder.path_expr
+    value = context
+    names = []
+    depth = 0
+    for segment in segments:
+        if segment == "__parent":
+            if names:
+                value = resolve(value, *names)
+                names = []
+            depth += 1
+            continue
+        if depth:
+            value = scope_parent(value, depth)
+            depth = 0
+        if segment.startswith("@") and not names:
+            if segment == "@root":
+                value = scope_root(value)
+            else:
+                value = scope_data(value, segment[1:])
+        elif segment:
+            names.append(segment)
+    if depth:
+        value = scope_parent(value, depth)
+    if names:
+        value = resolve(value, *names)
+    return value
+
+def _argument(arg, context):
+    if arg[0] == "literalparam":
+        value = arg[1]
+        if type(value) is str:
+            value = ast.literal_eval(value)
+        return value
+    return _path_value([_segment(segment) for segment in arg[1]], context)
+
+def _arguments(arguments, context):
+    args = []
+    kwargs = {}
+    for arg in arguments:
+        if arg[0] == "kwparam":
+            kwargs[arg[1]] = _argument(arg[2], context)
+        else:
+            args.append(_argument(arg, context))
+    return args, kwargs
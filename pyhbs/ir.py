@@ -0,0 +1,509 @@
+"""
+Intermediate representation of a template, between the parse tree and the
+generated code: a list of typed nodes, rewritten by optimisation passes
+(see PassManager) before CodeBuilder turns it into Python source.
+"""
+import ast
+
+from . import hbs_compiler
+
+class Node(object):
+    __slots__ = ()
+
+    def children(self):
+        # (label, nodes) of the node lists nested in this node
+        return ()
+
+class Literal(Node):
+    """Text output as is."""
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return "Literal(%r)" % (self.text,)
+
+class Path(Node):
+    """
+    A path argument or looked up value. segments are names, '' for this,
+    '.' and '/', '__parent' for '../' and '@name' for data variables.
+    """
+    __slots__ = ('segments',)
+
+    def __init__(self, segments):
+        self.segments = tuple(segments)
+
+    @property
+    def simple(self):
+        return len(self.segments) == 1
+
+    def __str__(self):
+        text = ""
+        for segment in self.segments:
+            if segment == "__parent":
+                text += "../"
+            elif segment:
+                text += segment if not text or text.endswith("/") else "." + segment
+        return text or "this"
+
+    def __repr__(self):
+        return "Path(%s)" % self
+
+class Hoisted(Path):
+    """
+    A path in the body of a Loop whose value is the same for every item:
+    the index-th value computed before the loop.
+    """
+    __slots__ = ('index',)
+
+    def __init__(self, segments, index):
+        Path.__init__(self, segments)
+        self.index = index
+
+    def __repr__(self):
+        return "Hoisted(%s, %d)" % (self, self.index)
+
+class Const(Node):
+    """A literal argument: string, integer or boolean."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return "Const(%r)" % (self.value,)
+
+def _call_repr(node, name):
+    params = [name] + [repr(arg) for arg in node.args]
+    params += ["%s=%r" % (key, value) for key, value in node.kwargs]
+    return ", ".join(params)
+
+class Lookup(Node):
+    """
+    {{path args}}: the value at path, called with args if it is callable.
+    field is set by bind_helpers on simple names that are not helpers of
+    the compile-time helper table.
+    """
+    __slots__ = ('path', 'args', 'kwargs', 'escaped', 'field')
+
+    def __init__(self, path, args=(), kwargs=(), escaped=True, field=False):
+        self.path = path
+        self.args = tuple(args)
+        self.kwargs = tuple(kwargs)
+        self.escaped = escaped
+        self.field = field
+
+    def __repr__(self):
+        flags = "".join([", escaped" if self.escaped else "", ", field" if self.field else ""])
+        return "Lookup(%s%s)" % (_call_repr(self, str(self.path)), flags)
+
+class HelperCall(Node):
+    """{{name args}} where name is a helper of the compile-time helper table."""
+    __slots__ = ('name', 'args', 'kwargs', 'escaped')
+
+    def __init__(self, name, args=(), kwargs=(), escaped=True):
+        self.name = name
+        self.args = tuple(args)
+        self.kwargs = tuple(kwargs)
+        self.escaped = escaped
+
+    def __repr__(self):
+        return "HelperCall(%s%s)" % (_call_repr(self, self.name), ", escaped" if self.escaped else "")
+
+class Block(Node):
+    """
+    {{#name args}}body{{else}}inverse{{/name}}; inverse is None without
+    {{else}}. bound is set by bind_helpers when name is a helper of the
+    compile-time helper table.
+    """
+    __slots__ = ('name', 'args', 'kwargs', 'body', 'inverse', 'bound')
+
+    def __init__(self, name, args=(), kwargs=(), body=(), inverse=None, bound=False):
+        self.name = name
+        self.args = tuple(args)
+        self.kwargs = tuple(kwargs)
+        self.body = list(body)
+        self.inverse = None if inverse is None else list(inverse)
+        self.bound = bound
+
+    def children(self):
+        return (("body", self.body), ("else", self.inverse))
+
+    def __repr__(self):
+        return "%s(%s%s)" % (type(self).__name__, _call_repr(self, self.name),
+                             ", bound" if self.bound else "")
+
+class Loop(Block):
+    """
+    {{#each}} block of the built-in each helper. hoisted are the paths
+    computed once before the loop (see hoist_lookups), relative to the
+    scope each renders the items in.
+    """
+    __slots__ = ('hoisted',)
+
+    def __init__(self, args=(), kwargs=(), body=(), inverse=None, hoisted=()):
+        Block.__init__(self, "each", args, kwargs, body, inverse, True)
+        self.hoisted = list(hoisted)
+
+    def __repr__(self):
+        text = Block.__repr__(self)
+        if self.hoisted:
+            text = "%s, hoisted=[%s])" % (text[:-1], ", ".join(map(str, self.hoisted)))
+        return text
+
+class InvertedBlock(Node):
+    """{{^name}}body{{/name}}: body is rendered when name is falsy."""
+    __slots__ = ('name', 'body')
+
+    def __init__(self, name, body=()):
+        self.name = name
+        self.body = list(body)
+
+    def children(self):
+        return (("body", self.body),)
+
+    def __repr__(self):
+        return "InvertedBlock(%s)" % self.name
+
+class Branch(Node):
+    """
+    The branch of a block a built-in helper always renders (see
+    remove_dead_branches), rendered in the scope the helper would give it.
+    """
+    __slots__ = ('body',)
+
+    def __init__(self, body=()):
+        self.body = list(body)
+
+    def children(self):
+        return (("body", self.body),)
+
+    def __repr__(self):
+        return "Branch()"
+
+class Partial(Node):
+    """
+    {{> name arg}}; body is the IR of the partial when it is inlined,
+    otherwise it is looked up and called at render time.
+    """
+    __slots__ = ('name', 'arg', 'body')
+
+    def __init__(self, name, arg=None, body=None):
+        self.name = name
+        self.arg = arg
+        self.body = body
+
+    def children(self):
+        return (("inlined", self.body),)
+
+    def __repr__(self):
+        if self.arg is None:
+            return "Partial(%s)" % self.name
+        return "Partial(%s, %r)" % (self.name, self.arg)
+
+def _segment(segment):
+    return '' if segment in ("this", ".", "/") else segment
+
+def _argument(arg):
+    if arg[0] == "literalparam":
+        value = arg[1]
+        if type(value) is str:
+            value = ast.literal_eval(value)
+        return Const(value)
+    return Path([_segment(segment) for segment in arg[1]])
+
+def _arguments(arguments):
+    args = []
+    kwargs = []
+    for arg in arguments:
+        if arg[0] == "kwparam":
+            kwargs.append((arg[1], _argument(arg[2])))
+        else:
+            args.append(_argument(arg))
+    return args, kwargs
+
+def from_tree(tree, inline=None):
+    """
+    IR of a parse tree (see Compiler.parse). inline(name) returns the IR
+    of a partial to inline at its call sites, or None.
+    """
+    nodes = []
+    for node in tree[1:]:
+        kind = node[0]
+        if kind == "literal":
+            nodes.append(Literal(node[1]))
+        elif kind == "expand" or kind == "escapedexpand":
+            args, kwargs = _arguments(node[2])
+            path = Path([_segment(segment) for segment in node[1][1]])
+            nodes.append(Lookup(path, args, kwargs, kind == "escapedexpand"))
+        elif kind == "block":
+            args, kwargs = _arguments(node[2])
+            inverse = from_tree(node[4], inline) if node[4] else None
+            nodes.append(Block(node[1], args, kwargs, from_tree(node[3], inline), inverse))
+        elif kind == "invertedblock":
+            nodes.append(InvertedBlock(node[1], from_tree(node[3], inline)))
+        elif kind == "partial":
+            args, kwargs = _arguments(node[2])
+            assert not kwargs and len(args) <= 1, node[2]
+            body = inline(node[1]) if inline is not None else None
+            nodes.append(Partial(node[1], args[0] if args else None, body))
+    return nodes
+
+def walk(nodes):
+    # every node of nodes and of the node lists nested in them
+    for node in nodes:
+        yield node
+        for label, body in node.children():
+            if body is not None:
+                for inner in walk(body):
+                    yield inner
+
+def dependencies(nodes):
+    """
+    Names of the helpers and partials the template refers to, see
+    template.invalidate(). Taken before the passes, which may drop them.
+    """
+    found = {"helpers": set(), "partials": set()}
+    for node in walk(nodes):
+        if isinstance(node, Partial):
+            found["partials"].add(node.name)
+        elif isinstance(node, Block):
+            found["helpers"].add(node.name)
+        elif isinstance(node, HelperCall):
+            found["helpers"].add(node.name)
+        elif isinstance(node, Lookup) and node.path.simple:
+            name = node.path.segments[0]
+            if name and not name.startswith("@") and name != "__parent":
+                found["helpers"].add(name)
+    return found
+
+def uses_parent(nodes):
+    # whether nodes, but not the partials inlined in them, refer to '../'
+    for node in nodes:
+        if isinstance(node, Partial):
+            values = [node.arg]
+        else:
+            values = [getattr(node, "path", None)] + list(getattr(node, "args", ()))
+            values += [value for key, value in getattr(node, "kwargs", ())]
+            for label, body in node.children():
+                if body is not None and uses_parent(body):
+                    return True
+        for value in values:
+            if isinstance(value, Path) and "__parent" in value.segments:
+                return True
+    return False
+
+def dump(nodes, indent=""):
+    lines = []
+    for node in nodes:
+        lines.append(indent + repr(node) + "\n")
+        for label, body in node.children():
+            if body is not None:
+                lines.append(indent + "  %s:\n" % label)
+                lines.append(dump(body, indent + "    "))
+    return "".join(lines)
+
+def _map_bodies(nodes, rewrite, helpers):
+    # applies the pass rewrite to the node lists nested in nodes
+    for node in nodes:
+        if isinstance(node, Block):
+            node.body = rewrite(node.body, helpers)
+            if node.inverse is not None:
+                node.inverse = rewrite(node.inverse, helpers)
+        elif isinstance(node, (InvertedBlock, Branch)):
+            node.body = rewrite(node.body, helpers)
+        elif isinstance(node, Partial) and node.body is not None:
+            node.body = rewrite(node.body, helpers)
+
+def bind_helpers(nodes, helpers):
+    """
+    Resolves names against the compile-time helper table: simple lookups
+    become HelperCall or field Lookup nodes, blocks of known helpers are
+    bound and {{#each}} of the built-in helper becomes a Loop.
+    """
+    result = []
+    for node in nodes:
+        if isinstance(node, Lookup) and node.path.simple:
+            name = node.path.segments[0]
+            if name and not name.startswith("@") and name != "__parent":
+                if name in helpers:
+                    node = HelperCall(name, node.args, node.kwargs, node.escaped)
+                else:
+                    node.field = True
+        elif type(node) is Block and node.name in helpers:
+            if node.name == "each" and helpers[node.name] is hbs_compiler.builtin_helpers["each"]:
+                node = Loop(node.args, node.kwargs, node.body, node.inverse)
+            else:
+                node.bound = True
+        result.append(node)
+    _map_bodies(result, bind_helpers, helpers)
+    return result
+
+def _constant_branch(node, helpers):
+    """
+    The branch a built-in conditional helper renders given its literal
+    arguments: node.body, node.inverse, [] or None if it is not known.
+    """
+    if helpers.get(node.name) is not hbs_compiler.builtin_helpers.get(node.name):
+        return None
+    values = []
+    for arg in node.args:
+        if not isinstance(arg, Const):
+            return None
+        values.append(arg.value)
+    kwargs = {}
+    for key, arg in node.kwargs:
+        if not isinstance(arg, Const):
+            return None
+        kwargs[key] = arg.value
+    inverse = node.inverse or []
+    try:
+        if node.name == "if" and len(values) == 1 and not kwargs:
+            return node.body if values[0] else inverse
+        if node.name == "unless" and len(values) == 1 and not kwargs:
+            # unless never renders its {{else}}
+            return [] if values[0] else node.body
+        if node.name == "ifeq" and len(values) == 2 and not kwargs:
+            return node.body if values[0] == values[1] else inverse
+        if node.name == "compare" and 2 <= len(values) + len(kwargs) <= 3:
+            return _compare_branch(node, inverse, *values, **kwargs)
+    except TypeError:
+        return None
+    return None
+
+def _compare_branch(node, inverse, val1, val2, operator="="):
+    test = hbs_compiler._compare_operators.get(operator)
+    if test is None:
+        return None
+    return node.body if test(val1, val2) else inverse
+
+def remove_dead_branches(nodes, helpers):
+    """
+    Blocks of the built-in conditionals (if, unless, ifeq, compare) with
+    only literal arguments are replaced by the branch they would render:
+    inline when it is only text, otherwise as a Branch.
+    """
+    result = []
+    for node in nodes:
+        if type(node) is Block:
+            branch = _constant_branch(node, helpers)
+            if branch is not None:
+                branch = remove_dead_branches(branch, helpers)
+                if all(isinstance(inner, Literal) for inner in branch):
+                    result.extend(branch)
+                else:
+                    result.append(Branch(branch))
+                continue
+        result.append(node)
+    _map_bodies(result, remove_dead_branches, helpers)
+    return result
+
+def merge_literals(nodes, helpers):
+    """Adjacent Literal nodes become one, empty ones are dropped."""
+    result = []
+    for node in nodes:
+        if isinstance(node, Literal):
+            if not node.text:
+                continue
+            if result and isinstance(result[-1], Literal):
+                result[-1] = Literal(result[-1].text + node.text)
+                continue
+        result.append(node)
+    _map_bodies(result, merge_literals, helpers)
+    return result
+
+def _invariant(path):
+    """
+    The path relative to the `this` scope the built-in each renders its
+    items in (Scope(item, this)) when path does not depend on the item,
+    or None: paths starting with '../' or '@root', followed by names.
+    """
+    segments = list(path.segments)
+    if segments[0] == "@root":
+        rest = segments[1:]
+    else:
+        depth = 0
+        while depth < len(segments) and segments[depth] == "__parent":
+            depth += 1
+        if not depth:
+            return None
+        rest = segments[depth:]
+        segments = segments[1:]
+    if not any(rest) or any(segment.startswith("@") or segment == "__parent"
+                            for segment in rest):
+        return None
+    return segments
+
+def _hoist_loop(loop):
+    found = {}
+    def hoist(arg):
+        if not isinstance(arg, Path) or isinstance(arg, Hoisted):
+            return arg
+        outer = _invariant(arg)
+        if outer is None:
+            return arg
+        if arg.segments not in found:
+            found[arg.segments] = len(loop.hoisted)
+            loop.hoisted.append(Path(outer))
+        return Hoisted(arg.segments, found[arg.segments])
+    # only the nodes rendered by the loop body itself: nested blocks and
+    # inlined partials render in other scopes
+    for node in loop.body:
+        if isinstance(node, Lookup):
+            node.path = hoist(node.path)
+        if isinstance(node, (Lookup, HelperCall, Block)):
+            node.args = tuple(hoist(arg) for arg in node.args)
+            node.kwargs = tuple((key, hoist(arg)) for key, arg in node.kwargs)
+        elif isinstance(node, Partial):
+            node.arg = hoist(node.arg)
+
+def hoist_lookups(nodes, helpers):
+    """
+    Lookups of '../name' and '@root.name' in the body of a Loop are
+    computed once before the loop instead of once per item.
+    """
+    for node in walk(nodes):
+        if isinstance(node, Loop):
+            _hoist_loop(node)
+    return nodes
+
+# passes by name; a pass takes the IR and the compile-time helper table
+# and returns the new IR
+passes = {
+    "bind_helpers": bind_helpers,
+    "remove_dead_branches": remove_dead_branches,
+    "hoist_lookups": hoist_lookups,
+    "merge_literals": merge_literals,
+}
+
+default_passes = ("bind_helpers", "remove_dead_branches", "hoist_lookups", "merge_literals")
+
+def register_pass(name, func):
+    passes[name] = func
+
+class PassManager(object):
+    """
+    Runs the passes named in names, in that order (default_passes by
+    default). With dump, a file, the IR is written to it before the first
+    pass and after each pass.
+    """
+
+    def __init__(self, names=None, dump=None):
+        names = default_passes if names is None else tuple(names)
+        for name in names:
+            if name not in passes:
+                raise Exception("Invalid compiler pass: '%s'" % name)
+        self.names = names
+        self.dump = dump
+
+    def run(self, nodes, helpers):
+        self._dump("parse", nodes)
+        for name in self.names:
+            nodes = passes[name](nodes, helpers)
+            self._dump(name, nodes)
+        return nodes
+
+    def _dump(self, name, nodes):
+        if self.dump is not None:
+            self.dump.write("-- %s\n%s" % (name, dump(nodes, "  ")))
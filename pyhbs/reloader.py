@@ -0,0 +1,181 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+_IN_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE
+_EVENT = struct.Struct("iIII")
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+class PollingWatcher(threading.Thread):
+    """
+    Stat the watched files at most once per interval and call
+    callback(path) for every file whose mtime or size has changed.
+    """
+
+    def __init__(self, callback, interval=2.0):
+        threading.Thread.__init__(self, name="pyhbs-reloader", daemon=True)
+        self.callback = callback
+        self.interval = interval
+        self._files = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def watch(self, path):
+        sig = file_signature(path)
+        with self._lock:
+            self._files[path] = sig
+
+    def unwatch(self, path):
+        with self._lock:
+            self._files.pop(path, None)
+
+    def check(self):
+        with self._lock:
+            files = list(self._files.items())
+        for path, sig in files:
+            new_sig = file_signature(path)
+            if new_sig == sig:
+                continue
+            with self._lock:
+                if path not in self._files:
+                    continue
+                self._files[path] = new_sig
+            self.callback(path)
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self._stopped.set()
+
+class InotifyWatcher(threading.Thread):
+    """
+    Watch the directories of the watched files with inotify and call
+    callback(path) when one of them is rewritten, replaced or removed.
+    Files whose directory can't be watched (missing, or the watch limit
+    reached) are polled every interval seconds instead.
+    """
+
+    def __init__(self, callback, libc, interval=2.0):
+        threading.Thread.__init__(self, name="pyhbs-reloader", daemon=True)
+        self.callback = callback
+        self._libc = libc
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}  # directory -> watch descriptor
+        self._wds = {}  # watch descriptor -> directory
+        self._files = {}  # (directory, name) -> set of watched paths
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.interval = interval
+        self._polling = None
+
+    def watch(self, path):
+        directory, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            if directory not in self._dirs:
+                wd = self._libc.inotify_add_watch(
+                    self._fd, os.fsencode(directory), _IN_MASK)
+                if wd < 0:
+                    polling = self._polling
+                    if polling is None:
+                        polling = self._polling = PollingWatcher(self.callback, self.interval)
+                        polling.start()
+                    polling.watch(path)
+                    return
+                self._dirs[directory] = wd
+                self._wds[wd] = directory
+            self._files.setdefault((directory, name), set()).add(path)
+
+    def unwatch(self, path):
+        directory, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            paths = self._files.get((directory, name))
+            if paths:
+                paths.discard(path)
+            if self._polling is not None:
+                self._polling.unwatch(path)
+
+    def _read_events(self):
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed = []
+        pos = 0
+        while pos + _EVENT.size <= len(buf):
+            wd, mask, cookie, length = _EVENT.unpack_from(buf, pos)
+            pos += _EVENT.size
+            name = os.fsdecode(buf[pos:pos + length].rstrip(b"\0"))
+            pos += length
+            with self._lock:
+                directory = self._wds.get(wd)
+                paths = self._files.get((directory, name))
+                if paths:
+                    changed.extend(paths)
+        return changed
+
+    def run(self):
+        try:
+            while not self._stopped.is_set():
+                ready, _, _ = select.select([self._fd], [], [], 0.5)
+                if not ready or self._stopped.is_set():
+                    continue
+                for path in self._read_events():
+                    self.callback(path)
+        finally:
+            os.close(self._fd)
+
+    def stop(self):
+        self._stopped.set()
+        if self._polling is not None:
+            self._polling.stop()
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                           use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+def create_watcher(callback, interval=2.0, use_inotify=True):
+    """
+    Start an inotify watcher when the platform supports it, otherwise a
+    polling watcher that stats the watched files every interval seconds.
+    """
+    watcher = None
+    if use_inotify:
+        libc = _load_libc()
+        if libc is not None:
+            try:
+                watcher = InotifyWatcher(callback, libc, interval)
+            except OSError:
+                watcher = None
+    if watcher is None:
+        watcher = PollingWatcher(callback, interval)
+    watcher.start()
+    return watcher
@@ -0,0 +1,239 @@
+"""
+Context schemas: the declared shape of a template's context, taken from a
+dataclass or a JSON schema. The compiler turns lookups of declared fields
+into direct indexing or attribute access.
+"""
+import json
+
+try:
+    import typing
+except ImportError:  # python < 3.5
+    typing = None
+
+try:
+    import dataclasses
+except ImportError:  # python < 3.7
+    dataclasses = None
+
+class Schema(object):
+    """
+    kind is "mapping" (fields read with [name]), "object" (fields read as
+    attributes of an instance of cls), "array" (items is the schema of the
+    elements) or "scalar". fields maps a name to (schema, required); only
+    required fields are known not to be missing or None.
+    """
+    __slots__ = ('kind', 'cls', 'fields', 'items')
+
+    def __init__(self, kind, cls=None, fields=None, items=None):
+        self.kind = kind
+        self.cls = cls
+        self.fields = fields or {}
+        self.items = items
+
+    def field(self, name):
+        if self.kind not in ("mapping", "object"):
+            return None
+        if self.kind == "object" and name.startswith("_"):
+            # hidden from templates, see hbs_compiler._get_attribute
+            return None
+        return self.fields.get(name)
+
+    def resolve(self, names):
+        # schema of the value at names, or None if it is not declared
+        schema = self
+        for name in names:
+            field = schema.field(name)
+            if field is None:
+                return None
+            schema = field[0]
+        return schema
+
+    def types(self):
+        """
+        Classes of the "object" schemas, in a stable order: the compiled
+        guards refer to them by index.
+        """
+        found = []
+        seen = set()
+        def visit(schema):
+            if schema is None or id(schema) in seen:
+                return
+            seen.add(id(schema))
+            if schema.kind == "object" and schema.cls not in found:
+                found.append(schema.cls)
+            for name in sorted(schema.fields):
+                visit(schema.fields[name][0])
+            visit(schema.items)
+        visit(self)
+        return tuple(found)
+
+    def __repr__(self):
+        if self.kind == "array":
+            return "Schema(array of %r)" % (self.items,)
+        if self.kind == "scalar":
+            return "Schema(scalar)"
+        return "Schema(%s %s: %s)" % (self.kind, self.cls.__name__, ", ".join(sorted(self.fields)))
+
+SCALAR = Schema("scalar")
+
+def from_json(schema):
+    kind = schema.get("type")
+    if kind == "object":
+        required = set(schema.get("required", ()))
+        fields = {}
+        for name, sub in schema.get("properties", {}).items():
+            fields[name] = (from_json(sub), name in required)
+        return Schema("mapping", dict, fields)
+    if kind == "array":
+        return Schema("array", items=from_json(schema.get("items", {})))
+    return SCALAR
+
+def _from_type(tp, known):
+    # (schema, required) of a field annotation
+    origin = getattr(tp, "__origin__", None)
+    args = getattr(tp, "__args__", None) or ()
+    if origin is typing.Union or type(tp).__name__ == "UnionType":
+        others = [arg for arg in args if arg is not type(None)]
+        if len(others) == 1:
+            return _from_type(others[0], known)[0], len(others) == len(args)
+        return SCALAR, False
+    if isinstance(tp, type) and dataclasses is not None and dataclasses.is_dataclass(tp):
+        return from_dataclass(tp, known), True
+    if origin in (list, tuple, typing.List, typing.Tuple) or (
+            origin is not None and origin.__name__ in ("Sequence", "Iterable")):
+        items = _from_type(args[0], known)[0] if args else SCALAR
+        return Schema("array", items=items), True
+    return SCALAR, True
+
+def from_dataclass(cls, known=None):
+    if known is None:
+        known = {}
+    if cls in known:
+        return known[cls]
+    schema = known[cls] = Schema("object", cls)
+    try:
+        hints = typing.get_type_hints(cls)
+    except Exception:
+        hints = {}
+    for field in dataclasses.fields(cls):
+        schema.fields[field.name] = _from_type(hints.get(field.name, field.type), known)
+    return schema
+
+def as_schema(schema):
+    """
+    A Schema from a Schema, a dataclass or a JSON schema (a dict, or its
+    JSON text).
+    """
+    if isinstance(schema, Schema):
+        return schema
+    if isinstance(schema, str):
+        schema = json.loads(schema)
+    if isinstance(schema, dict):
+        return from_json(schema)
+    if dataclasses is not None and dataclasses.is_dataclass(schema):
+        return from_dataclass(schema)
+    raise Exception("Invalid context schema: %r" % (schema,))
+
+def cache_key(schema):
+    """
+    Hashable key of a schema as passed to get_template(): equal JSON
+    schemas (dicts or JSON text) have the same key, a dataclass or a
+    Schema is its own key.
+    """
+    if isinstance(schema, str):
+        schema = json.loads(schema)
+    if isinstance(schema, dict):
+        return ("json", json.dumps(schema, sort_keys=True))
+    return schema
+
+def infer(value, depth=4, max_items=4):
+    """
+    Schema of the shape of value, observed to depth levels and on the
+    first max_items elements of sequences. Fields are never required:
+    other values of the same type may lack them.
+    """
+    cls = type(value)
+    if depth <= 0:
+        return SCALAR
+    if cls is dict:
+        fields = {}
+        for name, sub in value.items():
+            if type(name) is str:
+                fields[name] = (infer(sub, depth - 1, max_items), False)
+        return Schema("mapping", dict, fields)
+    if dataclasses is not None and dataclasses.is_dataclass(cls):
+        fields = {}
+        for field in dataclasses.fields(cls):
+            sub = getattr(value, field.name, None)
+            fields[field.name] = (infer(sub, depth - 1, max_items), False)
+        return Schema("object", cls, fields)
+    if cls in (list, tuple):
+        items = None
+        for item in value[:max_items]:
+            items = merge(items, infer(item, depth - 1, max_items))
+        return Schema("array", items=items or SCALAR)
+    return SCALAR
+
+def merge(a, b):
+    # a schema of the values of both schemas
+    if a is None or a is b:
+        return b
+    if b is None:
+        return a
+    if a.kind != b.kind or a.cls is not b.cls or a.kind == "scalar":
+        return SCALAR
+    if a.kind == "array":
+        return Schema("array", items=merge(a.items, b.items))
+    fields = dict(a.fields)
+    for name, (sub, required) in b.fields.items():
+        if name in fields:
+            sub = merge(fields[name][0], sub)
+        fields[name] = (sub, False)
+    return Schema(a.kind, a.cls, fields)
+
+def access(schema, names, expr):
+    """
+    (expr, rest): a Python expression reading the longest declared prefix
+    of names from expr, a value of schema, and the names left to resolve
+    generically. Descends only through required mappings and objects.
+    """
+    for i, name in enumerate(names):
+        field = schema.field(name)
+        if field is None:
+            return expr, names[i:]
+        sub, required = field
+        if schema.kind == "mapping":
+            if required:
+                expr = "%s[%r]" % (expr, name)
+            else:
+                expr = "%s.get(%r)" % (expr, name)
+        else:
+            expr = "%s.%s" % (expr, name)
+        if not required or sub.kind not in ("mapping", "object"):
+            return expr, names[i + 1:]
+        schema = sub
+    return expr, []
+
+# block helpers that render their block with the context they were given
+passthrough_helpers = frozenset(("if", "unless", "compare", "ifeq", "if_match", "cache"))
+
+def block_schema(symbol, names, schema):
+    """
+    Schema of the context of the block of the helper symbol, called with
+    a path to names as its first argument (None if it is not a path), in
+    a context of schema.
+    """
+    if symbol in passthrough_helpers:
+        return schema
+    if names is None:
+        return None
+    value = schema.resolve(names)
+    if value is None:
+        return None
+    if symbol == "each" and value.kind == "array":
+        value = value.items
+    elif symbol != "with":
+        return None
+    if value.kind in ("mapping", "object"):
+        return value
+    return None
@@ -1,14 +1,22 @@
-from . import hbs_compiler
+import collections
+import concurrent.futures
+import fnmatch
+import gc
+import hashlib
+import itertools
+import marshal
+import os
+import threading
+import time
 
-#Benefit for runtime
-_template_cache={}
+from . import hbs_compiler
+from . import interpreter
+from . import reloader
+from . import schema as schemas
 
 class Template(object):
     pass
 
-def register_helper(name,func):
-    hbs_compiler.register_helper(name,func)
-
 def get_template_src(file_path):
     try:
         f = open(file_path,"r")
@@ -20,39 +28,740 @@ def get_template_src(file_path):
         
     return tmpl
 
-def get_template(file_path):
-    tmpl=_template_cache.get(file_path)
-    if tmpl:
-        return tmpl
-    tmpl_src = get_template_src(file_path)
+def _cache_path(key):
+    # templates compiled with a non-default autoescape mode are cached
+    # under (file_path, autoescape)
+    return key[0] if type(key) is tuple else key
+
+def find_templates(directory, pattern="*.hbs"):
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(fnmatch.filter(files, pattern)):
+            paths.append(os.path.join(root, name))
+    return paths
+
+def _warmup_compile(file_path, settings):
+    # runs in the worker processes: code objects are shipped back marshalled
+    start = time.perf_counter()
     try:
-        compiler = hbs_compiler.Compiler()
-        py_src = compiler.compile(tmpl_src)
-        tmpl = Template()
-        exec(py_src, tmpl.__dict__)
+        env = Environment(**settings)
+        code = marshal.dumps(env._compile_code(get_template_src(file_path), file_path))
+        error = None
     except Exception as e:
-        print("Template source:")
-        print(tmpl_src)
-        raise Exception("Failed to compile template: %s" % file_path)
-    _template_cache[file_path] = tmpl
-    return tmpl
+        code = None
+        error = "%s: %s" % (type(e).__name__, e)
+    return file_path, code, time.perf_counter() - start, error
 
-def render_file(file_path, context, data={}):
-    tmpl = get_template(file_path)
-    scope = hbs_compiler.Scope(context,context,data=data)
-    result = "".join(tmpl.render(scope))
-    return result
+class TierState(object):
+    """
+    Tiering of one compiled template: renders run the generic code until
+    threshold, then the shapes of the next contexts are sampled and the
+    template is recompiled with fast paths for them (see Environment).
+    """
+    __slots__ = ('renders', 'specialised_renders', 'samples', 'schema', 'special', 'lock')
 
-def render_source(tmpl_src, context, data={}):
-    tmpl = None
-    try:
-        compiler = hbs_compiler.Compiler()
+    def __init__(self):
+        self.renders = 0
+        self.specialised_renders = 0
+        self.samples = 0
+        self.schema = None
+        self.special = None
+        self.lock = threading.Lock()
+
+class Environment(object):
+    """
+    The helpers, partials, template caches and compile options of a set of
+    templates, e.g. one per tenant. Templates are compiled against an
+    environment and its helper table is bound into their code once, so it
+    is not copied on every render. The module-level functions use
+    default_environment.
+    """
+
+    def __init__(self, helpers=None, partials=None, partial_dirs=(),
+                 autoescape=None, inline_partials=True, source_cache_size=256,
+                 builtins=True, specialisers=None, tiering=False, tier_threshold=1000,
+                 tier_samples=8, interpret_renders=2, passes=None, dump_ir=None):
+        """
+        helpers and partials are {name: function} and {name: source} (or
+        {name: (source, autoescape)}) maps, specialisers the compile-time
+        hooks of the helpers by name (see register_helper). tiering enables
+        the adaptive recompilation of render_file templates (see
+        enable_tiering). render_source interprets a source for its first
+        interpret_renders renders before compiling it (0 always compiles).
+        passes and dump_ir are the IR pass options of the compiler (see
+        hbs_compiler.Compiler).
+        autoescape is the default mode of every template (None infers it
+        from the file extension, render_source uses "html"), builtins=False
+        leaves out each, if, with... from the helper table (but not
+        helperMissing and blockHelperMissing, which the generated code
+        calls).
+        """
+        if builtins:
+            self.helpers = dict(hbs_compiler.builtin_helpers)
+        else:
+            self.helpers = dict((name, hbs_compiler.builtin_helpers[name])
+                                for name in ("helperMissing", "blockHelperMissing"))
+        self.specialisers = dict(hbs_compiler.builtin_specialisers) if builtins else {}
+        for name, func in (helpers or {}).items():
+            self.helpers[name] = func
+            self.specialisers.pop(name, None)
+        self.specialisers.update(specialisers or {})
+        self.autoescape = autoescape
+        self.inline_partials = inline_partials
+        self.tiering = tiering
+        self.tier_threshold = tier_threshold
+        self.tier_samples = tier_samples
+        self.interpret_renders = interpret_renders
+        self.passes = passes
+        self.dump_ir = dump_ir
+        self._templates = {}
+        self._schemas = {}
+        self._template_locks = {}
+        self._template_locks_lock = threading.Lock()
+        self._reloader = None
+        # compiled render_source templates, keyed by a hash of the source
+        self._source_cache = collections.OrderedDict()
+        self._source_cache_lock = threading.Lock()
+        self._source_cache_size = source_cache_size
+        # partials: registered sources, directories searched for partial
+        # files and the compiled partials / resolved file paths by name
+        self._partial_sources = {}
+        self._partial_dirs = list(partial_dirs)
+        self._partial_cache = {}
+        self._partial_lock = threading.Lock()
+        # dependency graph: ("file", path), ("partial", name) or
+        # ("helper", name) -> the (cache, key) entries compiled against it,
+        # and back
+        self._dependents = {}
+        self._dependencies_of = {}
+        self._deps_lock = threading.Lock()
+        # backend of the {{#cache}} helper: fragments are never shared
+        # between environments
+        self.fragment_cache = hbs_compiler.TTLCache()
+        self._fragment_stats = {"hits": 0, "misses": 0}
+        # sorted lists of {{#each ... cache_sort=version}}
+        self._sorted_views = hbs_compiler.TTLCache(maxsize=32)
+        for name, source in (partials or {}).items():
+            if type(source) is tuple:
+                self.register_partial(name, *source)
+            else:
+                self.register_partial(name, source)
+
+    def _settings(self):
+        # constructor arguments recreating the compile side of this
+        # environment in a warmup worker
+        return {
+            "partials": dict(self._partial_sources),
+            "partial_dirs": self._partial_dirs,
+            "autoescape": self.autoescape,
+            "inline_partials": self.inline_partials,
+            "builtins": False,
+            # the compiler only needs the names of the helpers, and which
+            # ones are the built-in ones
+            "helpers": dict((name, func if func is hbs_compiler.builtin_helpers.get(name) else None)
+                            for name, func in self.helpers.items()),
+            "specialisers": self.specialisers,
+            "passes": self.passes,
+        }
+
+    def register_helper(self, name, func, pure=False, cache="render", maxsize=128,
+                        specialise=None):
+        """
+        pure=True memoises the helper's results by its arguments, within one
+        render (cache="render") or across renders in an LRU of maxsize entries
+        (cache="global"). See helper_cache_info() for hit statistics.
+
+        specialise(*args, **kwargs) is called at compile time for the call
+        sites with literal arguments (the others are DYNAMIC) and may return
+        a callable, taking the same arguments as func, that replaces the
+        helper at that call site, e.g. with a precompiled regex.
+        """
+        if pure:
+            func = hbs_compiler.MemoizedHelper(func, cache, maxsize)
+        self.helpers[name] = func
+        if specialise is None:
+            self.specialisers.pop(name, None)
+        else:
+            self.specialisers[name] = specialise
+        self.invalidate(("helper", name))
+
+    def helper_cache_info(self, name):
+        helper = self.helpers.get(name)
+        if not isinstance(helper, hbs_compiler.MemoizedHelper):
+            return None
+        return helper.cache_info()
+
+    def set_fragment_cache(self, backend):
+        """
+        backend of the {{#cache}} fragments: any object with get(key) and
+        set(key, value, ttl) methods, see hbs_compiler.TTLCache.
+        """
+        self.fragment_cache = backend
+
+    def get_fragment_cache(self):
+        return self.fragment_cache
+
+    def fragment_cache_info(self):
+        return dict(self._fragment_stats)
+
+    def _render(self, tmpl, scope, partials=None):
+        hbs_compiler.begin_render()
+        try:
+            return "".join(tmpl.render(scope, partials=partials))
+        finally:
+            hbs_compiler.end_render()
+
+    def _template_changed(self, file_path):
+        self.invalidate(("file", file_path))
+
+    def _forget(self, entry):
+        # call with _deps_lock held
+        for dep in self._dependencies_of.pop(entry, ()):
+            entries = self._dependents.get(dep)
+            if entries is not None:
+                entries.discard(entry)
+                if not entries:
+                    del self._dependents[dep]
+
+    def _record_dependencies(self, cache, key, tmpl, file_path=None):
+        """
+        Index the compiled tmpl, stored under key in cache ("template",
+        "source" or "partial"), by the files, partials and helpers its code
+        was generated from.
+        """
+        deps = set()
+        if file_path is not None:
+            deps.add(("file", file_path))
+        names = getattr(tmpl, "dependencies", {})
+        for name in names.get("partials", ()):
+            deps.add(("partial", name))
+            if name not in self._partial_sources:
+                path = self.find_partial_file(name)
+                if path is not None:
+                    deps.add(("file", path))
+        for name in names.get("helpers", ()):
+            deps.add(("helper", name))
+        entry = (cache, key)
+        with self._deps_lock:
+            self._forget(entry)
+            self._dependencies_of[entry] = deps
+            for dep in deps:
+                self._dependents.setdefault(dep, set()).add(entry)
+        if self._reloader is not None:
+            for kind, path in deps:
+                if kind == "file":
+                    self._reloader.watch(path)
+
+    def dependents(self, dep):
+        with self._deps_lock:
+            return set(self._dependents.get(dep, ()))
+
+    def invalidate(self, dep):
+        """
+        Drop the cached templates compiled against dep: ("file", path),
+        ("partial", name) or ("helper", name). Templates that inlined a partial
+        depend on it and on its file, so only those are recompiled when the
+        partial changes. Returns the dropped (cache, key) entries.
+        """
+        with self._deps_lock:
+            entries = self._dependents.pop(dep, set())
+            for entry in entries:
+                self._forget(entry)
+        for cache, key in entries:
+            if cache == "template":
+                self._templates.pop(key, None)
+            elif cache == "source":
+                with self._source_cache_lock:
+                    self._source_cache.pop(key, None)
+            else:
+                self._partial_cache.pop(key, None)
+        return entries
+
+    def enable_auto_reload(self, interval=2.0, use_inotify=True):
+        """
+        Recompile templates whose file changed on disk. Changes are picked up
+        by a background thread (inotify when available, otherwise a stat of
+        every cached template each interval seconds), so cache hits in
+        get_template stay free of syscalls.
+        """
+        self.disable_auto_reload()
+        self._reloader = reloader.create_watcher(self._template_changed, interval, use_inotify)
+        for key in list(self._templates):
+            self._reloader.watch(_cache_path(key))
+        with self._deps_lock:
+            paths = [dep[1] for dep in self._dependents if dep[0] == "file"]
+        for path in paths:
+            if os.path.exists(path):
+                self._reloader.watch(path)
+        return self._reloader
+
+    def disable_auto_reload(self):
+        if self._reloader is not None:
+            self._reloader.stop()
+            self._reloader = None
+
+    def _template_lock(self, file_path):
+        lock = self._template_locks.get(file_path)
+        if lock is None:
+            with self._template_locks_lock:
+                lock = self._template_locks.setdefault(file_path, threading.Lock())
+        return lock
+
+    def _autoescape_for(self, file_path):
+        if self.autoescape is not None:
+            return self.autoescape
+        return hbs_compiler.autoescape_for(file_path)
+
+    def _schema(self, schema):
+        # the Schema of a dataclass or JSON schema, converted once per
+        # distinct schema so that equal ones share the compiled templates
+        key = schemas.cache_key(schema)
+        found = self._schemas.get(key)
+        if found is None:
+            found = self._schemas.setdefault(key, schemas.as_schema(schema))
+        return found
+
+    def get_template(self, file_path, autoescape=None, schema=None):
+        """
+        autoescape selects how {{...}} values are escaped: "html", "json",
+        "url" or "none". By default it is inferred from the file extension.
+
+        schema declares the shape of the context (a dataclass or a JSON
+        schema): lookups of declared fields are compiled to direct indexing
+        or attribute access, used when the context has the declared type
+        and matches the schema. The template is compiled and cached
+        separately for each distinct schema (equal JSON schemas share it).
+        """
+        key = file_path
+        if autoescape is not None and autoescape != self._autoescape_for(file_path):
+            key = (file_path, autoescape)
+        if schema is not None:
+            schema = self._schema(schema)
+            key = (file_path, autoescape, schema)
+        tmpl=self._templates.get(key)
+        if tmpl:
+            return tmpl
+        # single flight: concurrent first requests wait for one compile
+        with self._template_lock(key):
+            tmpl=self._templates.get(key)
+            if tmpl:
+                return tmpl
+            return self._load_template(file_path, autoescape, key, schema)
+
+    def _load_template(self, file_path, autoescape=None, key=None, schema=None):
+        if self._reloader is not None:
+            # signature is taken before reading so a write racing the compile
+            # is still seen as a change
+            self._reloader.watch(file_path)
+        tmpl_src = get_template_src(file_path)
+        try:
+            tmpl = self._make_template(self._compile_code(tmpl_src, file_path, autoescape, schema),
+                                       schema)
+        except Exception as e:
+            print("Template source:")
+            print(tmpl_src)
+            raise Exception("Failed to compile template: %s" % file_path)
+        key = file_path if key is None else key
+        self._record_dependencies("template", key, tmpl, file_path)
+        self._templates[key] = tmpl
+        return tmpl
+
+    def _compile_code(self, tmpl_src, filename="<template>", autoescape=None, schema=None,
+                      guard_stats=False):
+        if autoescape is None:
+            autoescape = self._autoescape_for(filename)
+        loader = self.partial_source if self.inline_partials else None
+        compiler = hbs_compiler.Compiler(autoescape, loader, self.specialisers,
+                                         self.helpers, schema, guard_stats, self.passes,
+                                         self.dump_ir)
         py_src = compiler.compile(tmpl_src)
+        return compile(py_src, filename, "exec")
+
+    def _make_template(self, code, schema=None):
         tmpl = Template()
-        exec(py_src, tmpl.__dict__)
-    except Exception as e:
-        print("ERROR - Template source:")
-        print(tmpl_src)
-    scope = hbs_compiler.Scope(context,context,data=data)
-    result = "".join(tmpl.render(scope))
-    return result
+        exec(code, tmpl.__dict__)
+        # the generated module falls back to the global helpers and
+        # partials; bind it to this environment's instead
+        tmpl.bind(self.helpers, self.specialisers)
+        if schema is not None:
+            tmpl.schema_types = schema.types()
+        tmpl.get_partial = self.get_partial
+        tmpl.environment = self
+        return tmpl
+
+    def warmup(self, directory, pattern="*.hbs", workers=None):
+        """
+        Compile every template under directory matching pattern in a process
+        pool and fill the template cache with the results, so that the first
+        requests after a deploy don't pay for the compile.
+
+        Returns {"compiled": {path: seconds}, "failed": {path: error}}.
+        """
+        paths = find_templates(directory, pattern)
+        settings = self._settings()
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers > 1 and len(paths) > 1:
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                results = list(pool.map(_warmup_compile, paths, itertools.repeat(settings)))
+        else:
+            results = [_warmup_compile(path, settings) for path in paths]
+        report = {"compiled": {}, "failed": {}}
+        for file_path, code, seconds, error in results:
+            if error is not None:
+                report["failed"][file_path] = error
+                continue
+            if self._reloader is not None:
+                self._reloader.watch(file_path)
+            tmpl = self._make_template(marshal.loads(code))
+            self._record_dependencies("template", file_path, tmpl, file_path)
+            self._templates[file_path] = tmpl
+            report["compiled"][file_path] = seconds
+        return report
+
+    def register_partial(self, name, source, autoescape="html"):
+        with self._partial_lock:
+            self._partial_sources[name] = (source, autoescape)
+            self._partial_cache.pop(name, None)
+            self.invalidate(("partial", name))
+
+    def add_partial_dir(self, directory):
+        """
+        {{> name}} is looked up as name.hbs, then _name.hbs, in the added
+        directories (in order) when it is not a registered partial.
+        """
+        with self._partial_lock:
+            self._partial_dirs.append(directory)
+            self._partial_cache.clear()
+
+    def clear_partials(self):
+        with self._partial_lock:
+            self._partial_sources.clear()
+            del self._partial_dirs[:]
+            self._partial_cache.clear()
+            with self._deps_lock:
+                deps = [dep for dep in self._dependents if dep[0] == "partial"]
+            for dep in deps:
+                self.invalidate(dep)
+
+    def find_partial_file(self, name):
+        for directory in self._partial_dirs:
+            for file_name in (name + ".hbs", "_" + name + ".hbs"):
+                path = os.path.join(directory, file_name)
+                if os.path.isfile(path):
+                    return path
+        return None
+
+    def partial_source(self, name):
+        """
+        (source, autoescape) of a registered or file partial, or None. Used by
+        the compiler to inline partials.
+        """
+        if name in self._partial_sources:
+            return self._partial_sources[name]
+        path = self.find_partial_file(name)
+        if path is None:
+            return None
+        return get_template_src(path), hbs_compiler.autoescape_for(path)
+
+    def get_partial(self, name):
+        """
+        The render function of a partial, compiled once on first use. File
+        partials live in the template cache, so auto reload applies to them.
+        """
+        entry = self._partial_cache.get(name)
+        if entry is None:
+            with self._partial_lock:
+                entry = self._partial_cache.get(name)
+                if entry is None:
+                    if name in self._partial_sources:
+                        source, autoescape = self._partial_sources[name]
+                        entry = self.compile_source(source, autoescape)
+                        self._record_dependencies("partial", name, entry)
+                    else:
+                        entry = self.find_partial_file(name)
+                        if entry is None:
+                            raise Exception("Could not find partial: %s" % name)
+                    self._partial_cache[name] = entry
+        if type(entry) is str:
+            entry = self.get_template(entry)
+        return entry.render
+
+    def enable_tiering(self, threshold=1000, samples=8):
+        """
+        After threshold renders of a template through render_file, the
+        shapes (dict keys, dataclass types) of the contexts of the next
+        samples renders are recorded and the template is recompiled with
+        them as its schema: lookups read the observed fields directly while
+        the contexts keep that shape, and fall back to the generic code
+        where they don't. See tier_info() for how often that happens.
+        """
+        self.tier_threshold = threshold
+        self.tier_samples = samples
+        self.tiering = True
+
+    def disable_tiering(self):
+        self.tiering = False
+
+    def _tier(self, tmpl, file_path, autoescape, context):
+        # the template to render this context with
+        state = tmpl.__dict__.get("tier")
+        if state is None:
+            state = tmpl.__dict__.setdefault("tier", TierState())
+        special = state.special
+        state.renders += 1
+        if special is not None:
+            if special is not tmpl:
+                state.specialised_renders += 1
+            return special
+        if state.renders <= self.tier_threshold:
+            return tmpl
+        observed = schemas.infer(context)
+        with state.lock:
+            if state.special is not None:
+                return state.special
+            state.schema = schemas.merge(state.schema, observed)
+            state.samples += 1
+            if state.samples >= self.tier_samples:
+                state.special = self._specialise(file_path, autoescape, state.schema) or tmpl
+        return tmpl
+
+    def _specialise(self, file_path, autoescape, schema):
+        if schema.kind not in ("mapping", "object"):
+            return None
+        try:
+            code = self._compile_code(get_template_src(file_path), file_path, autoescape,
+                                      schema, guard_stats=True)
+            return self._make_template(code, schema)
+        except Exception:
+            # stay in the generic tier
+            return None
+
+    def tier_info(self, file_path, autoescape=None):
+        """
+        {"tier": "generic", "sampling" or "specialised", "renders": ...,
+        "specialised_renders": ..., "guards": {"typed": n, "generic": n}}
+        of a template rendered with tiering, or None. The guard counts are
+        the calls of the specialised functions that took the fast path or
+        the generic lookups, the typed lookups that failed and fell back
+        counting as generic too.
+        """
+        key = file_path
+        if autoescape is not None and autoescape != self._autoescape_for(file_path):
+            key = (file_path, autoescape)
+        tmpl = self._templates.get(key)
+        state = tmpl.__dict__.get("tier") if tmpl is not None else None
+        if state is None:
+            return None
+        special = state.special
+        if special is not None and special is not tmpl:
+            tier = "specialised"
+            generic, typed = special.guard_stats
+        else:
+            tier = "sampling" if special is None and state.samples else "generic"
+            generic = typed = 0
+        return {
+            "tier": tier,
+            "renders": state.renders,
+            "specialised_renders": state.specialised_renders,
+            "guards": {"typed": typed, "generic": generic},
+        }
+
+    def render_file(self, file_path, context, data={}, autoescape=None, partials=None,
+                    schema=None):
+        tmpl = self.get_template(file_path, autoescape, schema)
+        if self.tiering and schema is None:
+            tmpl = self._tier(tmpl, file_path, autoescape, context)
+        scope = hbs_compiler.Scope(context,context,data=data)
+        return self._render(tmpl, scope, partials)
+
+    def set_source_cache_size(self, size):
+        with self._source_cache_lock:
+            self._source_cache_size = size
+            while len(self._source_cache) > size:
+                self._evict_source()
+
+    def _evict_source(self):
+        # call with _source_cache_lock held
+        key, tmpl = self._source_cache.popitem(last=False)
+        with self._deps_lock:
+            self._forget(("source", key))
+
+    def clear_source_cache(self):
+        with self._source_cache_lock:
+            while self._source_cache:
+                self._evict_source()
+
+    def compile_source(self, tmpl_src, autoescape=None):
+        if autoescape is None:
+            autoescape = self.autoescape or "html"
+        key = _source_key(tmpl_src, autoescape)
+        with self._source_cache_lock:
+            tmpl = self._source_cache.get(key)
+            if tmpl is not None and type(tmpl) is not interpreter.InterpretedTemplate:
+                self._source_cache.move_to_end(key)
+                return tmpl
+        try:
+            tmpl = self._make_template(self._compile_code(tmpl_src, autoescape=autoescape))
+        except Exception as e:
+            print("ERROR - Template source:")
+            print(tmpl_src)
+            raise Exception("Failed to compile template source")
+        with self._source_cache_lock:
+            if self._source_cache_size > 0:
+                self._record_dependencies("source", key, tmpl)
+                self._source_cache[key] = tmpl
+                while len(self._source_cache) > self._source_cache_size:
+                    self._evict_source()
+        return tmpl
+
+    def _source_template(self, tmpl_src, autoescape=None):
+        """
+        The template render_source uses: the parse tree of the source is
+        interpreted for its first interpret_renders renders and compiled
+        when it is rendered again.
+        """
+        if autoescape is None:
+            autoescape = self.autoescape or "html"
+        if self.interpret_renders <= 0:
+            return self.compile_source(tmpl_src, autoescape)
+        key = _source_key(tmpl_src, autoescape)
+        with self._source_cache_lock:
+            tmpl = self._source_cache.get(key)
+            if tmpl is not None:
+                self._source_cache.move_to_end(key)
+                if type(tmpl) is not interpreter.InterpretedTemplate:
+                    return tmpl
+                tmpl.uses += 1
+                if tmpl.uses <= self.interpret_renders:
+                    return tmpl
+        if tmpl is not None:
+            return self.compile_source(tmpl_src, autoescape)
+        try:
+            tree = hbs_compiler.Compiler(autoescape).parse(tmpl_src)
+            tmpl = interpreter.InterpretedTemplate(tree, autoescape, self.helpers, self.get_partial,
+                                                  self)
+        except Exception as e:
+            print("ERROR - Template source:")
+            print(tmpl_src)
+            raise Exception("Failed to compile template source")
+        tmpl.uses = 1
+        with self._source_cache_lock:
+            if self._source_cache_size > 0:
+                self._record_dependencies("source", key, tmpl)
+                self._source_cache[key] = tmpl
+                while len(self._source_cache) > self._source_cache_size:
+                    self._evict_source()
+        return tmpl
+
+    def render_source(self, tmpl_src, context, data={}, autoescape=None, partials=None):
+        tmpl = self._source_template(tmpl_src, autoescape)
+        scope = hbs_compiler.Scope(context,context,data=data)
+        return self._render(tmpl, scope, partials)
+
+def _source_key(tmpl_src, autoescape):
+    return (hashlib.sha1(tmpl_src.encode("utf-8")).hexdigest(), autoescape)
+
+# the default environment shares its helper table with hbs_compiler, where
+# register_helper has always put the helpers
+default_environment = Environment()
+default_environment.helpers = hbs_compiler.get_helpers()
+default_environment.specialisers = hbs_compiler.get_specialisers()
+_default = default_environment
+_template_cache = _default._templates
+_source_cache = _default._source_cache
+
+def register_helper(name, func, pure=False, cache="render", maxsize=128, specialise=None):
+    """
+    See Environment.register_helper.
+    """
+    _default.register_helper(name, func, pure, cache, maxsize, specialise)
+
+def helper_cache_info(name):
+    return _default.helper_cache_info(name)
+
+def set_fragment_cache(backend):
+    _default.set_fragment_cache(backend)
+
+def get_fragment_cache():
+    return _default.get_fragment_cache()
+
+def fragment_cache_info():
+    return _default.fragment_cache_info()
+
+def dependents(dep):
+    return _default.dependents(dep)
+
+def invalidate(dep):
+    return _default.invalidate(dep)
+
+def enable_auto_reload(interval=2.0, use_inotify=True):
+    return _default.enable_auto_reload(interval, use_inotify)
+
+def disable_auto_reload():
+    _default.disable_auto_reload()
+
+def get_template(file_path, autoescape=None, schema=None):
+    return _default.get_template(file_path, autoescape, schema)
+
+def warmup(directory, pattern="*.hbs", workers=None):
+    return _default.warmup(directory, pattern, workers)
+
+def freeze_templates(directory=None, pattern="*.hbs", workers=None):
+    """
+    For prefork servers: call in the master process before forking.
+    Compiles the templates under directory (if given) into the cache and
+    moves every object allocated so far into the permanent GC generation,
+    so that collections in the workers don't write to the pages holding
+    the compiled templates and they stay shared copy-on-write.
+    """
+    report = None
+    if directory is not None:
+        report = warmup(directory, pattern, workers)
+    gc.collect()
+    if hasattr(gc, "freeze"):  # python 3.7+
+        gc.freeze()
+    return report
+
+def register_partial(name, source, autoescape="html"):
+    _default.register_partial(name, source, autoescape)
+
+def add_partial_dir(directory):
+    _default.add_partial_dir(directory)
+
+def clear_partials():
+    _default.clear_partials()
+
+def find_partial_file(name):
+    return _default.find_partial_file(name)
+
+def partial_source(name):
+    return _default.partial_source(name)
+
+def get_partial(name):
+    return _default.get_partial(name)
+
+def enable_tiering(threshold=1000, samples=8):
+    _default.enable_tiering(threshold, samples)
+
+def disable_tiering():
+    _default.disable_tiering()
+
+def tier_info(file_path, autoescape=None):
+    return _default.tier_info(file_path, autoescape)
+
+def render_file(file_path, context, data={}, autoescape=None, partials=None, schema=None):
+    return _default.render_file(file_path, context, data, autoescape, partials, schema)
+
+def set_source_cache_size(size):
+    _default.set_source_cache_size(size)
+
+def clear_source_cache():
+    _default.clear_source_cache()
+
+def compile_source(tmpl_src, autoescape="html"):
+    return _default.compile_source(tmpl_src, autoescape)
+
+def render_source(tmpl_src, context, data={}, autoescape="html", partials=None):
+    return _default.render_source(tmpl_src, context, data, autoescape, partials)
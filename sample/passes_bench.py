@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Compile and render the same template with no IR pass, with each pass of
+pyhbs.ir.default_passes alone, with all of them and with all but one.
+
+    python3 passes_bench.py [--rows 200] [--renders 500]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pyhbs
+from pyhbs import ir
+
+SOURCE = """<table>{{! rows }}
+{{#each rows}}<tr>{{! one row }}
+    <td>{{number}}</td>{{! number }}<td>{{name}}</td><td lang="{{@root.settings.locale}}">{{../currency}}</td>
+    {{#if true}}<td class="price">{{price}}</td>{{/if}}{{#if false}}<td>debug</td>{{/if}}
+    {{#ifeq "compact" "compact"}}<td>-</td>{{else}}<td>{{customer.name}}</td>{{/ifeq}}
+</tr>
+{{/each}}</table>"""
+
+def measure(passes, context, renders):
+    env = pyhbs.Environment(passes=passes, interpret_renders=0)
+    compile_ms = min(timeit.repeat(lambda: env._compile_code(SOURCE), number=20, repeat=3)) / 20 * 1e3
+    tmpl = env.compile_source(SOURCE)
+    render = lambda: tmpl.render(pyhbs.Scope(context, context))
+    render_ms = min(timeit.repeat(render, number=renders, repeat=5)) / renders * 1e3
+    return compile_ms, render_ms
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--renders", type=int, default=500)
+    args = parser.parse_args()
+    rows = [{"number": i, "name": "n%d" % i, "price": i * 1.5, "customer": {"name": "c%d" % i}}
+            for i in range(args.rows)]
+    context = {"currency": "EUR", "settings": {"locale": "fr"}, "rows": rows}
+    configs = [("none", ())] + [(name, (name,)) for name in ir.default_passes]
+    configs.append(("all", ir.default_passes))
+    configs += [("all but " + name, tuple(other for other in ir.default_passes if other != name))
+                for name in ir.default_passes]
+    print("rows: %d, renders: %d" % (args.rows, args.renders))
+    for name, passes in configs:
+        compile_ms, render_ms = measure(passes, context, args.renders)
+        print("%-32s compile %6.2f ms  render %7.3f ms" % (name, compile_ms, render_ms))
+
+if __name__ == "__main__":
+    main()
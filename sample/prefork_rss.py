@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Measure the unique memory (USS) of forked workers with and without
+freeze_templates() in the master process.
+
+    python3 prefork_rss.py [--templates 300] [--workers 4]
+
+Linux only (reads /proc/<pid>/smaps_rollup).
+"""
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pyhbs
+
+ROW = """<tr>
+    <td>{{number}}</td><td>{{name}}</td>
+    {{#if active}}<td class="on">{{currency price}}</td>{{else}}<td>-</td>{{/if}}
+    {{#with obj}}<td>{{foo}} {{bar}}</td>{{/with}}
+</tr>
+"""
+
+def make_templates(directory, count):
+    for i in range(count):
+        with open(os.path.join(directory, "page%d.hbs" % i), "w") as f:
+            f.write("<h1>Page %d {{title}}</h1>\n" % i)
+            f.write("{{#each rows}}%s{{/each}}\n" % (ROW * 5))
+
+def uss_kb(pid):
+    total = 0
+    with open("/proc/%d/smaps_rollup" % pid) as f:
+        for line in f:
+            if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                total += int(line.split()[1])
+    return total
+
+def run(directory, workers, mode):
+    pyhbs.template._template_cache.clear()
+    paths = pyhbs.find_templates(directory)
+    if mode == "warmup":
+        pyhbs.warmup(directory, workers=1)
+    elif mode == "freeze":
+        pyhbs.freeze_templates(directory, workers=1)
+    context = {"title": "t", "rows": [{"number": i, "name": "n", "active": i % 2,
+                                      "price": i, "obj": {"foo": 1, "bar": 2}}
+                                     for i in range(3)]}
+    children = []
+    for w in range(workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(read_fd)
+                for path in paths:
+                    pyhbs.render_file(path, context)
+                gc.collect()
+                os.write(write_fd, str(uss_kb(os.getpid())).encode())
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        children.append((pid, read_fd))
+    sizes = []
+    for pid, read_fd in children:
+        sizes.append(int(os.read(read_fd, 64)))
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+    if mode == "freeze" and hasattr(gc, "unfreeze"):
+        gc.unfreeze()
+    return sum(sizes) / len(sizes)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--templates", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    pyhbs.register_helper("currency", lambda this, value: "%.2f" % value)
+    directory = tempfile.mkdtemp()
+    try:
+        make_templates(directory, args.templates)
+        lazy = run(directory, args.workers, "lazy")
+        warm = run(directory, args.workers, "warmup")
+        frozen = run(directory, args.workers, "freeze")
+    finally:
+        shutil.rmtree(directory)
+    print("templates: %d, workers: %d" % (args.templates, args.workers))
+    print("per-worker USS, compiled lazily in each worker: %8.0f kB" % lazy)
+    print("per-worker USS, warmup() in master:             %8.0f kB" % warm)
+    print("per-worker USS, freeze_templates() in master:   %8.0f kB" % frozen)
+
+if __name__ == "__main__":
+    main()
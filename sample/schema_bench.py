@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Render the same row template with and without a context schema, for dict
+contexts (JSON schema) and dataclass contexts.
+
+    python3 schema_bench.py [--rows 200] [--renders 500]
+"""
+import argparse
+import dataclasses
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import typing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pyhbs
+
+SOURCE = """<h1>{{title}}</h1>
+{{#each rows}}<tr>
+    <td>{{number}}</td><td>{{name}}</td><td>{{customer.name}}</td>
+    {{#if active}}<td class="on">{{price}}</td>{{else}}<td>-</td>{{/if}}
+</tr>
+{{/each}}"""
+
+@dataclasses.dataclass
+class Customer:
+    name: str
+
+@dataclasses.dataclass
+class Row:
+    number: int
+    name: str
+    active: bool
+    price: float
+    customer: Customer
+
+@dataclasses.dataclass
+class Page:
+    title: str
+    rows: typing.List[Row]
+
+JSON_SCHEMA = {
+    "type": "object",
+    "required": ["title", "rows"],
+    "properties": {
+        "title": {"type": "string"},
+        "rows": {"type": "array", "items": {
+            "type": "object",
+            "required": ["number", "name", "active", "price", "customer"],
+            "properties": {
+                "number": {"type": "integer"},
+                "name": {"type": "string"},
+                "active": {"type": "boolean"},
+                "price": {"type": "number"},
+                "customer": {"type": "object", "required": ["name"],
+                             "properties": {"name": {"type": "string"}}},
+            },
+        }},
+    },
+}
+
+def measure(path, context, renders, schema=None):
+    pyhbs.render_file(path, context, schema=schema)
+    return min(timeit.repeat(lambda: pyhbs.render_file(path, context, schema=schema),
+                             number=renders, repeat=5)) / renders * 1e3
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--renders", type=int, default=500)
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "page.hbs")
+        with open(path, "w") as f:
+            f.write(SOURCE)
+        page = Page("t", [Row(i, "n%d" % i, bool(i % 2), i * 1.5, Customer("c%d" % i))
+                          for i in range(args.rows)])
+        as_dict = dataclasses.asdict(page)
+        results = [
+            ("dict, generic", measure(path, as_dict, args.renders)),
+            ("dict, JSON schema", measure(path, as_dict, args.renders, JSON_SCHEMA)),
+            ("dataclass, generic", measure(path, page, args.renders)),
+            ("dataclass, schema", measure(path, page, args.renders, Page)),
+        ]
+    finally:
+        shutil.rmtree(directory)
+    print("rows: %d, renders: %d" % (args.rows, args.renders))
+    for name, ms in results:
+        print("%-20s %7.3f ms per render" % (name, ms))
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
+import os
 import unittest
 
-from tests.test_simple import TestSimple
+
+def load_tests(loader, tests, pattern):
+    # every tests/test_*.py module
+    top = os.path.dirname(os.path.abspath(__file__))
+    return loader.discover(os.path.join(top, "tests"), top_level_dir=top)
 
 
 if __name__ == '__main__':
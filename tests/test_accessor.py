@@ -0,0 +1,38 @@
+from unittest import TestCase
+
+import pyhbs
+from pyhbs.hbs_compiler import Accessor, Scope
+
+
+class TestAccessor(TestCase):
+    def test_numeric_segments_are_converted_once(self):
+        accessor = Accessor("rows", "1", "name")
+        self.assertEqual(accessor.steps[1][0], 1)
+        context = {"rows": [{"name": "a"}, {"name": "b"}]}
+        self.assertEqual(accessor(Scope(context, None)), "b")
+        self.assertEqual(Accessor("d", "2")({"d": {2: "int key"}}), "int key")
+
+    def test_missing_values(self):
+        accessor = Accessor("a", "b", "5")
+        self.assertIsNone(accessor({"a": None}))
+        self.assertIsNone(accessor({"a": {"b": [1, 2]}}))
+        self.assertIsNone(accessor({}))
+
+    def test_cache_per_type(self):
+        accessor = Accessor("a")
+        accessor({"a": 1})
+        accessor(Scope({"a": 1}, None))
+        self.assertEqual(set(accessor.steps[0][1]), {dict, Scope})
+
+    def test_megamorphic_site_stays_correct(self):
+        accessor = Accessor("a")
+        classes = [type("Map%d" % i, (dict,), {}) for i in range(8)]
+        for i, cls in enumerate(classes):
+            self.assertEqual(accessor(cls(a=i)), i)
+        self.assertEqual(len(accessor.steps[0][1]), Accessor.max_types)
+
+    def test_rendered_path(self):
+        rows = [{"order": {"customer": {"address": {"city": c}}}} for c in "xyz"]
+        self.assertEqual(pyhbs.render_source(
+            "{{#each rows}}{{order.customer.address.city}}{{/each}}", {"rows": rows}),
+            "xyz")
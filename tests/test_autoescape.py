@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import pyhbs
+from pyhbs import template
+from pyhbs.hbs_compiler import Compiler, SafeString, autoescape_for
+
+
+class TestAutoescape(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for key in list(template._template_cache):
+            if template._cache_path(key).startswith(self.dir):
+                del template._template_cache[key]
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, source):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as f:
+            f.write(source)
+        return path
+
+    def test_inferred_from_extension(self):
+        self.assertEqual(autoescape_for("a/page.hbs"), "html")
+        self.assertEqual(autoescape_for("export.csv"), "none")
+        self.assertEqual(autoescape_for("mail.txt.hbs"), "none")
+        self.assertEqual(autoescape_for("data.JSON"), "json")
+        self.assertEqual(autoescape_for("unknown.xyz"), "html")
+
+    def test_text_template_is_not_escaped(self):
+        path = self._write("report.txt", "{{name}},{{amount}}")
+        self.assertEqual(pyhbs.render_file(path, {"name": "A & B", "amount": 1}), "A & B,1")
+        self.assertEqual(pyhbs.get_template(path).autoescape, "none")
+        self.assertNotIn("escape(", Compiler("none").compile("{{name}}").split("\n\n", 2)[2])
+
+    def test_explicit_mode_is_cached_separately(self):
+        path = self._write("page.hbs", "{{name}}")
+        self.assertEqual(pyhbs.render_file(path, {"name": "<b>"}), "&lt;b&gt;")
+        self.assertEqual(pyhbs.render_file(path, {"name": "<b>"}, autoescape="none"), "<b>")
+        self.assertEqual(pyhbs.render_file(path, {"name": "<b>"}), "&lt;b&gt;")
+
+    def test_json_and_url(self):
+        self.assertEqual(pyhbs.render_source(
+            '{"name": "{{name}}", "ok": {{ok}}}', {"name": 'say "hi"\n', "ok": True},
+            autoescape="json"), '{"name": "say \\"hi\\"\\n", "ok": true}')
+        self.assertEqual(pyhbs.render_source(
+            "/search?q={{q}}", {"q": "a b&c/d"}, autoescape="url"), "/search?q=a%20b%26c%2Fd")
+
+    def test_safe_string_is_only_html_safe(self):
+        value = SafeString('a" , "admin": true, "x": "')
+        self.assertEqual(pyhbs.render_source('{"v": "{{v}}"}', {"v": value}, autoescape="json"),
+                         '{"v": "a\\" , \\"admin\\": true, \\"x\\": \\""}')
+        self.assertEqual(pyhbs.render_source("?q={{q}}", {"q": SafeString("a&b=c")},
+                                             autoescape="url"), "?q=a%26b%3Dc")
+        self.assertEqual(pyhbs.render_source("{{v}}", {"v": SafeString("<b>")}), "<b>")
+
+    def test_invalid_mode(self):
+        self.assertRaises(Exception, Compiler("xml").compile, "{{a}}")
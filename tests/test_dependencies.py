@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import pyhbs
+from pyhbs import template
+
+from .test_reload import _wait_for
+
+
+class TestDependencies(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.row = os.path.join(self.dir, "_row.hbs")
+        self.page = os.path.join(self.dir, "page.hbs")
+        self.other = os.path.join(self.dir, "other.hbs")
+        self._write(self.row, "<td>{{name}}</td>")
+        self._write(self.page, "{{#each rows}}{{> row}}{{/each}}")
+        self._write(self.other, "other {{title}}")
+        pyhbs.add_partial_dir(self.dir)
+
+    def tearDown(self):
+        pyhbs.disable_auto_reload()
+        pyhbs.clear_partials()
+        for path in (self.row, self.page, self.other):
+            template.invalidate(("file", path))
+        shutil.rmtree(self.dir)
+
+    def _write(self, path, source):
+        with open(path, "w") as f:
+            f.write(source)
+
+    def test_recorded(self):
+        tmpl = pyhbs.get_template(self.page)
+        self.assertEqual(tmpl.dependencies["partials"], ["row"])
+        self.assertIn("each", tmpl.dependencies["helpers"])
+        self.assertEqual(template.dependents(("file", self.row)),
+                         {("template", self.page)})
+        self.assertEqual(template.dependents(("partial", "row")),
+                         {("template", self.page)})
+
+    def test_partial_file_invalidates_dependents_only(self):
+        page = pyhbs.get_template(self.page)
+        other = pyhbs.get_template(self.other)
+        self._write(self.row, "<th>{{name}}</th>")
+        dropped = template.invalidate(("file", self.row))
+        self.assertEqual(dropped, {("template", self.page)})
+        self.assertIs(pyhbs.get_template(self.other), other)
+        self.assertIsNot(pyhbs.get_template(self.page), page)
+        self.assertEqual(pyhbs.render_file(self.page, {"rows": [{"name": "a"}]}),
+                         "<th>a</th>")
+
+    def test_auto_reload_of_partial_file(self):
+        pyhbs.enable_auto_reload(interval=0.05, use_inotify=False)
+        self.assertEqual(pyhbs.render_file(self.page, {"rows": [{"name": "a"}]}),
+                         "<td>a</td>")
+        other = pyhbs.get_template(self.other)
+        self._write(self.row, "<th>{{name}}</th>")
+        self.assertTrue(_wait_for(
+            lambda: self.page not in template._template_cache))
+        self.assertEqual(pyhbs.render_file(self.page, {"rows": [{"name": "a"}]}),
+                         "<th>a</th>")
+        self.assertIs(pyhbs.get_template(self.other), other)
+
+    def test_register_partial(self):
+        self.assertEqual(pyhbs.render_file(self.page, {"rows": [{"name": "a"}]}),
+                         "<td>a</td>")
+        pyhbs.register_partial("row", "<li>{{name}}</li>")
+        self.assertNotIn(self.page, template._template_cache)
+        self.assertEqual(pyhbs.render_file(self.page, {"rows": [{"name": "a"}]}),
+                         "<li>a</li>")
+
+    def test_nested_registered_partials(self):
+        pyhbs.register_partial("cell", "[{{this}}]")
+        pyhbs.register_partial("line", "{{#each items}}{{> cell}}{{/each}}")
+        src = "{{> line}}"
+        self.assertEqual(pyhbs.render_source(src, {"items": [1, 2]}), "[1][2]")
+        pyhbs.register_partial("cell", "<{{this}}>")
+        self.assertEqual(pyhbs.render_source(src, {"items": [1, 2]}), "<1><2>")
+
+    def test_source_cache_eviction_forgets(self):
+        pyhbs.clear_source_cache()
+        pyhbs.render_source("{{> row}}", {"name": "a"})
+        self.assertEqual(len(template.dependents(("partial", "row"))), 1)
+        pyhbs.clear_source_cache()
+        self.assertEqual(template.dependents(("partial", "row")), set())
+
+    def test_register_helper(self):
+        # the public register_helper drops the templates using the helper
+        src = "{{#if true}}A{{else}}B{{/if}}"
+        original = pyhbs.get_helpers()["if"]
+        for i in range(3):
+            self.assertEqual(pyhbs.render_source(src, {}), "A")
+        self.assertIs(pyhbs.register_helper, pyhbs.hbs_compiler.register_helper)
+        pyhbs.register_helper("if", lambda this, options, value: "CUSTOM")
+        try:
+            self.assertEqual(pyhbs.render_source(src, {}), "CUSTOM")
+        finally:
+            pyhbs.register_helper("if", original)
+        self.assertEqual(pyhbs.render_source(src, {}), "A")
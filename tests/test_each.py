@@ -0,0 +1,121 @@
+from unittest import TestCase
+
+import pyhbs
+from pyhbs import hbs_compiler
+
+
+ROWS = [
+    {"name": "a", "price": 3, "qty": 1},
+    {"name": "b", "price": 1, "qty": 2},
+    {"name": "c", "price": 3, "qty": 2},
+    {"name": "d", "price": 2, "qty": 1},
+    {"name": "e", "price": 1, "qty": 1},
+]
+
+
+def render(args, rows=ROWS):
+    return pyhbs.render_source("{{#each rows %s}}{{name}}{{/each}}" % args, {"rows": rows})
+
+
+class TestEachOrder(TestCase):
+    def test_ascending_is_stable(self):
+        self.assertEqual(render('order="price"'), "bedac")
+
+    def test_descending_keeps_ties_in_input_order(self):
+        self.assertEqual(render('order="price desc"'), "acdbe")
+
+    def test_explicit_asc(self):
+        self.assertEqual(render('order="price asc"'), "bedac")
+
+    def test_top_k_matches_full_sort(self):
+        self.assertEqual(render('order="price desc" limit=2'), "ac")
+        self.assertEqual(render('order="price desc" offset=1 limit=2'), "cd")
+        self.assertEqual(render('order="price" offset=3'), "ac")
+
+    def test_multiple_keys(self):
+        self.assertEqual(render('order="price, qty desc"'), "bedca")
+        self.assertEqual(render('order="price, qty desc" limit=3'), "bed")
+        self.assertEqual(render('order="qty desc, price desc"'), "cbade")
+
+    def test_order_spec_is_parsed_once(self):
+        spec = hbs_compiler._parse_order("price desc, name")
+        self.assertEqual(spec, (("price", True), ("name", False)))
+        self.assertIs(hbs_compiler._parse_order("price desc, name"), spec)
+
+    def test_cached_sorted_view(self):
+        env = pyhbs.Environment()
+        source = '{{#each rows order="price" limit=2 cache_sort=version}}{{name}}{{/each}}'
+        rows = list(ROWS)
+        render = lambda version: env.render_source(source, {"rows": rows, "version": version})
+        self.assertEqual(render(1), "be")
+        calls = []
+        original = hbs_compiler._sort_items
+        def counting_sort(*args):
+            calls.append(args)
+            return original(*args)
+        hbs_compiler._sort_items = counting_sort
+        try:
+            self.assertEqual(render(1), "be")
+            self.assertEqual(calls, [])
+            # same length, new order: a new version sorts again
+            rows[0] = {"name": "f", "price": 0, "qty": 0}
+            self.assertEqual(render(2), "fb")
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(pyhbs.Environment().render_source(
+                source, {"rows": ROWS, "version": 2}), "be")
+        finally:
+            hbs_compiler._sort_items = original
+
+    def test_cached_views_by_call_site(self):
+        source = ('{{#each a order="n" cache_sort=v}}{{n}}{{/each}}|'
+                  '{{#each b order="n" cache_sort=v}}{{n}}{{/each}}')
+        context = {"a": [{"n": 2}, {"n": 1}], "b": [{"n": 9}, {"n": 8}], "v": 1}
+        for renders in (0, 2):
+            env = pyhbs.Environment(interpret_renders=renders)
+            for i in range(3):
+                self.assertEqual(env.render_source(source, context), "12|89")
+
+    def test_cache_sort_needs_a_version(self):
+        self.assertRaises(Exception, render, 'order="price" cache_sort=true')
+        self.assertEqual(render('order="price" cache_sort=false'), "bedac")
+
+
+class TestEachLazy(TestCase):
+    def test_data_variables(self):
+        self.assertEqual(pyhbs.render_source(
+            "{{#each rows}}{{@index}}{{name}}{{#if @first}}F{{/if}}{{#if @last}}L{{/if}},{{/each}}",
+            {"rows": ROWS[:3]}), "0aF,1b,2cL,")
+
+    def test_generator_is_consumed_lazily(self):
+        pulled = []
+        def rows():
+            for row in ROWS:
+                pulled.append(row["name"])
+                yield row
+        out = pyhbs.render_source("{{#each rows offset=1 limit=2}}{{name}}{{#if @last}}!{{/if}}{{/each}}",
+                                  {"rows": rows()})
+        self.assertEqual(out, "bc!")
+        self.assertEqual(pulled, ["a", "b", "c"])
+
+    def test_mapping(self):
+        prices = {"x": {"price": 2}, "y": {"price": 1}, "z": {"price": 3}}
+        self.assertEqual(pyhbs.render_source(
+            "{{#each prices}}{{@key}}={{price}}:{{@index}};{{/each}}", {"prices": prices}),
+            "x=2:0;y=1:1;z=3:2;")
+        self.assertEqual(pyhbs.render_source(
+            '{{#each prices order="price" limit=2}}{{@key}}{{/each}}', {"prices": prices}),
+            "yx")
+
+    def test_sorted_generator(self):
+        self.assertEqual(render('order="price desc" limit=2', iter(ROWS)), "ac")
+
+    def test_empty_iterator(self):
+        self.assertEqual(render("", iter([])), "")
+
+    def test_nested_arrays(self):
+        for renders in (0, 2):
+            env = pyhbs.Environment(interpret_renders=renders)
+            self.assertEqual(env.render_source("{{#each this}}{{.}}{{/each}}", ["a", "b"]), "ab")
+            self.assertEqual(env.render_source(
+                "{{#each rows}}[{{#each this}}{{@index}}{{.}}{{/each}}]{{/each}}",
+                {"rows": [[1, 2], [3]]}), "[0112][03]")
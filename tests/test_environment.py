@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import pyhbs
+from pyhbs import template
+
+
+class TestEnvironment(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.page = os.path.join(self.dir, "page.hbs")
+        with open(self.page, "w") as f:
+            f.write("{{#each rows}}{{money price}}{{> sep}}{{/each}}")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _tenant(self, symbol):
+        return pyhbs.Environment(
+            helpers={"money": lambda this, v: "%s%d" % (symbol, v)},
+            partials={"sep": symbol == "$" and "," or ";"})
+
+    def test_isolated_helpers_and_partials(self):
+        usd, eur = self._tenant("$"), self._tenant("E")
+        context = {"rows": [{"price": 1}, {"price": 2}]}
+        self.assertEqual(usd.render_file(self.page, context), "$1,$2,")
+        self.assertEqual(eur.render_file(self.page, context), "E1;E2;")
+        self.assertIsNot(usd.get_template(self.page), eur.get_template(self.page))
+        self.assertNotIn("money", pyhbs.hbs_compiler.get_helpers())
+        self.assertNotIn(self.page, template._template_cache)
+
+    def test_helper_table_is_bound_once(self):
+        env = self._tenant("$")
+        tmpl = env.compile_source("{{money 1}}")
+        self.assertIs(tmpl.bound_helpers, env.helpers)
+        self.assertEqual(env.render_source("{{money 1}}", {}), "$1")
+        env.register_helper("money", lambda this, v: "#%d" % v)
+        self.assertEqual(env.render_source("{{money 1}}", {}), "#1")
+
+    def test_render_time_helpers_are_merged(self):
+        env = self._tenant("$")
+        tmpl = env.compile_source("{{money 1}}{{#if x}}{{money 2}}{{/if}}")
+        scope = pyhbs.Scope({"x": True}, None)
+        money = {"money": lambda this, v: "~%d" % v}
+        self.assertEqual("".join(tmpl.render(scope, helpers=money)), "~1$2")
+        self.assertEqual("".join(tmpl.render(scope)), "$1$2")
+
+    def test_options(self):
+        env = pyhbs.Environment(autoescape="none", builtins=False)
+        self.assertEqual(env.render_source("{{a}}", {"a": "<"}), "<")
+        self.assertNotIn("each", env.helpers)
+        for renders in (0, 2):
+            env = pyhbs.Environment(builtins=False, interpret_renders=renders)
+            self.assertEqual(env.render_source("[{{missing}}]", {}), "[]")
+            self.assertEqual(env.render_source("{{#each rows}}{{.}}{{/each}}|{{#rows}}x{{/rows}}",
+                                               {"rows": [1, 2]}), "|xx")
+
+    def test_warmup(self):
+        env = self._tenant("$")
+        report = env.warmup(self.dir, workers=1)
+        self.assertEqual(list(report["compiled"]), [self.page])
+        self.assertEqual(env.render_file(self.page, {"rows": [{"price": 3}]}), "$3,")
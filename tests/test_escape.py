@@ -0,0 +1,36 @@
+from unittest import TestCase
+
+import pyhbs
+from pyhbs.hbs_compiler import SafeString, escape, strlist
+
+
+class Html:
+    def __html__(self):
+        return "<i>html</i>"
+
+
+class TestEscape(TestCase):
+    def test_special_characters(self):
+        self.assertEqual(escape("<a href='x'>Tom & \"Jerry\"`</a>"),
+                         "&lt;a href=&#x27;x&#x27;&gt;Tom &amp; &quot;Jerry&quot;&#x60;&lt;/a&gt;")
+        self.assertEqual(escape("&lt;"), "&amp;lt;")
+
+    def test_fast_paths(self):
+        self.assertEqual(escape(12), "12")
+        self.assertEqual(escape(1.5), "1.5")
+        self.assertEqual(escape(True), "True")
+        plain = "no specials here"
+        self.assertEqual(escape(plain), plain)
+        parts = strlist(["<b>"])
+        self.assertIs(escape(parts), parts)
+
+    def test_safe_strings_are_not_escaped(self):
+        value = escape(SafeString("<b>&amp;</b>"))
+        self.assertEqual(value, "<b>&amp;</b>")
+        self.assertIs(type(value), str)
+        self.assertEqual(escape(Html()), "<i>html</i>")
+
+    def test_helper_returning_safe_string(self):
+        pyhbs.register_helper("bold", lambda this, v: SafeString("<b>%s</b>" % escape(v)))
+        self.assertEqual(pyhbs.render_source("{{bold name}} {{name}}", {"name": "<x>"}),
+                         "<b>&lt;x&gt;</b> &lt;x&gt;")
@@ -0,0 +1,71 @@
+from unittest import TestCase
+
+import pyhbs
+from pyhbs.hbs_compiler import TTLCache
+
+
+class Clock:
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestFragmentCache(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.backend = TTLCache(maxsize=2, clock=self.clock)
+        pyhbs.set_fragment_cache(self.backend)
+        self.calls = []
+        pyhbs.register_helper("counted", lambda this, v: self.calls.append(v) or v)
+
+    def tearDown(self):
+        pyhbs.set_fragment_cache(TTLCache())
+
+    def render(self, context):
+        return pyhbs.render_source(
+            '{{#cache "nav" user ttl=60}}<nav>{{counted user}}</nav>{{/cache}}', context)
+
+    def test_hit_skips_body(self):
+        before = pyhbs.fragment_cache_info()
+        self.assertEqual(self.render({"user": "a"}), "<nav>a</nav>")
+        self.assertEqual(self.render({"user": "a"}), "<nav>a</nav>")
+        self.assertEqual(self.calls, ["a"])
+        after = pyhbs.fragment_cache_info()
+        self.assertEqual(after["hits"] - before["hits"], 1)
+        self.assertEqual(after["misses"] - before["misses"], 1)
+
+    def test_key_depends_on_arguments(self):
+        self.assertEqual(self.render({"user": "a"}), "<nav>a</nav>")
+        self.assertEqual(self.render({"user": "b"}), "<nav>b</nav>")
+        self.assertEqual(self.calls, ["a", "b"])
+
+    def test_ttl_expiry(self):
+        self.render({"user": "a"})
+        self.clock.now = 59
+        self.render({"user": "a"})
+        self.clock.now = 61
+        self.render({"user": "a"})
+        self.assertEqual(self.calls, ["a", "a"])
+
+    def test_lru_bound(self):
+        self.backend.set("x", "1")
+        self.backend.set("y", "2")
+        self.backend.get("x")
+        self.backend.set("z", "3")
+        self.assertEqual(len(self.backend), 2)
+        self.assertIsNone(self.backend.get("y"))
+        self.assertEqual(self.backend.get("x"), "1")
+
+    def test_environments_do_not_share_fragments(self):
+        source = '{{#cache "nav"}}<nav>{{user}}</nav>{{/cache}}'
+        first = pyhbs.Environment(interpret_renders=0)
+        second = pyhbs.Environment()
+        self.assertEqual(first.render_source(source, {"user": "a"}), "<nav>a</nav>")
+        self.assertEqual(second.render_source(source, {"user": "b"}), "<nav>b</nav>")
+        self.assertEqual(first.render_source(source, {"user": "b"}), "<nav>a</nav>")
+        self.assertEqual(second.render_source(source, {"user": "a"}), "<nav>b</nav>")
+        self.assertEqual(first.fragment_cache_info(), {"hits": 1, "misses": 1})
+        self.assertEqual(second.fragment_cache_info(), {"hits": 1, "misses": 1})
+        self.assertEqual(len(self.backend), 0)
+        self.assertIsNone(pyhbs.get_fragment_cache().get("nav"))
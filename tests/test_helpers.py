@@ -0,0 +1,47 @@
+from unittest import TestCase
+
+import pyhbs
+
+
+class TestPureHelpers(TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def _currency(self, this, value, scale=2):
+        self.calls.append(value)
+        return "%.*f" % (scale, value)
+
+    def test_render_cache(self):
+        pyhbs.register_helper("money_r", self._currency, pure=True)
+        source = "{{#each rows}}{{money_r price}} {{/each}}"
+        rows = [{"price": p} for p in (1, 2, 1, 1, 2)]
+        self.assertEqual(pyhbs.render_source(source, {"rows": rows}),
+                         "1.00 2.00 1.00 1.00 2.00 ")
+        self.assertEqual(self.calls, [1, 2])
+        # the cache does not outlive the render
+        pyhbs.render_source(source, {"rows": rows})
+        self.assertEqual(self.calls, [1, 2, 1, 2])
+        info = pyhbs.helper_cache_info("money_r")
+        self.assertEqual((info["hits"], info["misses"]), (6, 4))
+
+    def test_global_cache(self):
+        pyhbs.register_helper("money_g", self._currency, pure=True,
+                              cache="global", maxsize=2)
+        for i in range(3):
+            self.assertEqual(pyhbs.render_source("{{money_g 5 scale=1}}", {}), "5.0")
+        self.assertEqual(self.calls, [5])
+        pyhbs.render_source("{{money_g 1}}{{money_g 2}}{{money_g 5 scale=1}}", {})
+        self.assertEqual(self.calls, [5, 1, 2, 5])
+        self.assertEqual(pyhbs.helper_cache_info("money_g")["size"], 2)
+
+    def test_argument_types_are_part_of_the_key(self):
+        pyhbs.register_helper("kind", lambda this, v: type(v).__name__,
+                              pure=True, cache="global")
+        self.assertEqual(pyhbs.render_source("{{kind a}} {{kind b}}", {"a": 1, "b": True}),
+                         "int bool")
+
+    def test_unhashable_arguments_are_not_cached(self):
+        pyhbs.register_helper("count_r", lambda this, v: len(v), pure=True)
+        self.assertEqual(pyhbs.render_source("{{count_r a}}{{count_r a}}", {"a": [1, 2]}), "22")
+        self.assertEqual(pyhbs.helper_cache_info("count_r")["misses"], 0)
+        self.assertIsNone(pyhbs.helper_cache_info("each"))
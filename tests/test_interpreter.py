@@ -0,0 +1,73 @@
+from unittest import TestCase
+
+import pyhbs
+from pyhbs import hbs_compiler, interpreter, template
+
+
+SOURCES = [
+    "Hello {{name}}! {{{raw}}} {{&raw}} {{! comment }}",
+    "{{#each rows}}{{@index}}:{{name}}{{#if @first}}^{{/if}}{{../title}}{{@root.title}},{{else}}none{{/each}}",
+    "{{#with obj}}{{foo}} {{price}}{{/with}}{{#unless missing}}u{{/unless}}",
+    '{{#compare obj.price 10 ">"}}big{{else}}small{{/compare}}{{#if_match name "A%"}}A{{/if_match}}',
+    "{{this.name}} {{obj.foo}} {{rows.1.name}} {{[name]}}",
+    "{{^missing}}inverted {{name}}{{/missing}}{{^name}}never{{/name}}",
+    "{{#each obj}}{{@key}}={{this}};{{/each}}",
+    "{{greet name}} {{greet name punct=\"?\"}} {{> card obj}}",
+]
+
+CONTEXT = {
+    "name": "Anas <b>",
+    "raw": "<i>",
+    "title": "T",
+    "rows": [{"name": "a"}, {"name": "b"}],
+    "obj": {"foo": "bar", "price": 40},
+}
+
+
+class TestInterpreter(TestCase):
+    def setUp(self):
+        pyhbs.register_helper("greet", lambda this, name, punct="!": "hi %s%s" % (name, punct))
+        pyhbs.register_partial("card", "[{{foo}}|{{../name}}]")
+
+    def tearDown(self):
+        hbs_compiler.get_helpers().pop("greet")
+        pyhbs.clear_partials()
+        pyhbs.clear_source_cache()
+
+    def _interpret(self, source, context, autoescape="html"):
+        tree = hbs_compiler.Compiler().parse(source)
+        tmpl = interpreter.InterpretedTemplate(tree, autoescape, get_partial=pyhbs.get_partial)
+        return "".join(tmpl.render(pyhbs.Scope(context, context)))
+
+    def test_same_output_as_compiled(self):
+        for source in SOURCES:
+            for autoescape in ("html", "none", "url"):
+                compiled = pyhbs.compile_source(source, autoescape)
+                expected = "".join(compiled.render(pyhbs.Scope(CONTEXT, CONTEXT)))
+                self.assertEqual(self._interpret(source, CONTEXT, autoescape), expected, source)
+
+    def test_dependencies(self):
+        tree = hbs_compiler.Compiler().parse(SOURCES[7] + SOURCES[1])
+        tmpl = interpreter.InterpretedTemplate(tree)
+        env = pyhbs.Environment(inline_partials=False)
+        self.assertEqual(tmpl.dependencies,
+                         env.compile_source(SOURCES[7] + SOURCES[1]).dependencies)
+
+    def test_render_source_tiers_up(self):
+        source = "{{#each rows}}{{name}}{{/each}}"
+        key = template._source_key(source, "html")
+        for i in range(2):
+            self.assertEqual(pyhbs.render_source(source, CONTEXT), "ab")
+            self.assertIs(type(template._source_cache[key]), interpreter.InterpretedTemplate)
+        self.assertEqual(pyhbs.render_source(source, CONTEXT), "ab")
+        self.assertIs(template._source_cache[key], pyhbs.compile_source(source))
+        self.assertIs(type(template._source_cache[key]), template.Template)
+
+    def test_always_compile(self):
+        env = pyhbs.Environment(interpret_renders=0)
+        self.assertEqual(env.render_source("{{name}}", {"name": "x"}), "x")
+        self.assertIs(type(env.compile_source("{{name}}")), template.Template)
+
+    def test_errors(self):
+        self.assertRaises(Exception, pyhbs.render_source, "{{#if x}}{{/each}}", {})
+        self.assertRaises(Exception, pyhbs.render_source, "{{> nope}}", {})
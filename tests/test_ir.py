@@ -0,0 +1,131 @@
+import io
+from unittest import TestCase
+
+import pyhbs
+from pyhbs import hbs_compiler, ir
+
+
+SOURCES = [
+    "a{{! comment }}b{{#if true}}c{{/if}}{{#if false}}d{{else}}e{{/if}}",
+    "{{#unless true}}x{{else}}y{{/unless}}{{#ifeq 1 1}}[{{name}}]{{/ifeq}}",
+    '{{#compare 2 1 ">"}}{{#each rows}}{{name}}{{../name}}{{/each}}{{/compare}}',
+    '{{#compare 2 1 operator="<"}}big{{else}}{{name}}{{/compare}}',
+    "{{#each rows}}{{@index}}{{name}}{{else}}none{{/each}}{{^rows}}empty{{/rows}}",
+    "{{#if true}}{{../name}}{{/if}}{{#with obj}}{{foo}}{{/with}}",
+]
+
+CONTEXT = {"name": "N", "rows": [{"name": "a"}, {"name": "b"}], "obj": {"foo": "f"}}
+
+
+class TestIR(TestCase):
+    def _ir(self, source, passes=None):
+        compiler = hbs_compiler.Compiler(passes=())
+        nodes = compiler.build(compiler.parse(source))
+        return ir.PassManager(passes).run(nodes, hbs_compiler.get_helpers())
+
+    def _render(self, source, **options):
+        env = pyhbs.Environment(interpret_renders=0, **options)
+        return env.render_source(source, CONTEXT)
+
+    def test_node_types(self):
+        nodes = self._ir("x{{name}}{{{raw}}}{{#each rows}}{{fmt a}}{{/each}}{{> p obj}}", ())
+        self.assertEqual([type(node) for node in nodes],
+                         [ir.Literal, ir.Lookup, ir.Lookup, ir.Block, ir.Partial])
+        self.assertFalse(nodes[2].escaped)
+        self.assertEqual(str(nodes[4].arg), "obj")
+        nodes = ir.bind_helpers(nodes, {"each": hbs_compiler.builtin_helpers["each"], "fmt": None})
+        self.assertIsInstance(nodes[3], ir.Loop)
+        self.assertIsInstance(nodes[3].body[0], ir.HelperCall)
+        self.assertTrue(nodes[1].field)
+
+    def test_passes_keep_the_output(self):
+        for source in SOURCES:
+            expected = self._render(source, passes=())
+            for name in ir.default_passes:
+                self.assertEqual(self._render(source, passes=[name]), expected, (source, name))
+            self.assertEqual(self._render(source), expected, source)
+
+    def test_merge_and_dead_branches(self):
+        nodes = self._ir(SOURCES[0])
+        self.assertEqual(ir.dump(nodes), "Literal('abce')\n")
+        nodes = self._ir("{{#if true}}{{../name}}{{/if}}{{#unless true}}x{{/unless}}")
+        self.assertEqual([type(node) for node in nodes], [ir.Branch])
+        # not the built-in helper
+        helpers = dict(hbs_compiler.get_helpers(), **{"if": lambda this, options, value: "!"})
+        nodes = ir.remove_dead_branches(self._ir("{{#if true}}x{{/if}}", ()), helpers)
+        self.assertIsInstance(nodes[0], ir.Block)
+
+    def test_removed_blocks_are_dependencies(self):
+        code = hbs_compiler.Compiler().compile("{{#if false}}{{> p}}{{/if}}")
+        self.assertIn("dependencies = {'helpers': ['if'], 'partials': ['p']}", code)
+
+    def test_dump_ir(self):
+        out = io.StringIO()
+        hbs_compiler.Compiler(dump_ir=out).compile("a{{!c}}b{{#each rows}}{{name}}{{/each}}")
+        dumped = out.getvalue()
+        for name in ("parse",) + ir.default_passes:
+            self.assertIn("-- %s\n" % name, dumped)
+        self.assertIn("  Loop(each, Path(rows), bound)\n    body:\n      Lookup(name, escaped, field)\n",
+                      dumped)
+
+    def test_custom_pass(self):
+        def upper(nodes, helpers):
+            return [ir.Literal(node.text.upper()) if isinstance(node, ir.Literal) else node
+                    for node in nodes]
+        ir.register_pass("upper", upper)
+        try:
+            self.assertEqual(self._render("ab{{name}}", passes=["merge_literals", "upper"]), "ABN")
+        finally:
+            del ir.passes["upper"]
+        self.assertRaises(Exception, hbs_compiler.Compiler, passes=["upper"])
+
+
+class TestHoistLookups(TestCase):
+    SOURCE = ("{{#each rows}}{{name}}:{{../currency}}{{fmt price ../currency}}"
+              "{{@root.settings.locale}}{{#each ../cols}}{{../name}}{{this}}{{/each}}"
+              "{{> cell ../currency}};{{/each}}")
+    CONTEXT = {"currency": "$", "settings": {"locale": "fr"}, "cols": [1, 2],
+               "rows": [{"name": "a", "price": 1}, {"name": "b", "price": 2}]}
+
+    def _env(self, passes=None):
+        env = pyhbs.Environment(helpers={"fmt": lambda this, price, sign: "%s%s" % (sign, price)},
+                                interpret_renders=0, passes=passes)
+        env.register_partial("cell", "[{{this}}]")
+        return env
+
+    def test_invariant_paths(self):
+        compiler = hbs_compiler.Compiler(passes=())
+        nodes = compiler.build(compiler.parse(self.SOURCE))
+        helpers = dict(hbs_compiler.get_helpers(), fmt=None)
+        nodes = ir.hoist_lookups(ir.bind_helpers(nodes, helpers), helpers)
+        loop = nodes[0]
+        self.assertEqual([str(path) for path in loop.hoisted],
+                         ["currency", "@root.settings.locale", "cols"])
+        self.assertIsInstance(loop.body[2].path, ir.Hoisted)
+        self.assertIsInstance(loop.body[3].args[1], ir.Hoisted)
+        self.assertIsInstance(loop.body[4].path, ir.Hoisted)
+        self.assertIsInstance(loop.body[6].arg, ir.Hoisted)
+        # the inner loop renders in its own scope
+        inner = loop.body[5]
+        self.assertIsInstance(inner.args[0], ir.Hoisted)
+        self.assertEqual([str(path) for path in inner.hoisted], ["name"])
+        self.assertNotIsInstance(loop.body[0].path, ir.Hoisted)
+
+    def test_same_output(self):
+        expected = self._env(passes=("bind_helpers",)).render_source(self.SOURCE, self.CONTEXT)
+        self.assertEqual(expected, "a:$$1fra1a2[$];b:$$2frb1b2[$];")
+        env = self._env()
+        code = hbs_compiler.Compiler(helpers=env.helpers).compile(self.SOURCE)
+        self.assertIn("partial(render_block", code)
+        self.assertEqual(env.render_source(self.SOURCE, self.CONTEXT), expected)
+
+    def test_other_each_helper(self):
+        # a render-time each gets the generic loop body
+        def each(this, options, items):
+            return "".join(str(options["fn"](pyhbs.Scope(item, pyhbs.Scope({"currency": "E"}, this))))
+                           for item in items)
+        source = "{{#each rows}}{{name}}{{../currency}}{{/each}}"
+        tmpl = self._env().compile_source(source)
+        output = "".join(tmpl.render(self.CONTEXT, helpers={"each": each}))
+        self.assertEqual(output, "aEbE")
+        self.assertEqual("".join(tmpl.render(self.CONTEXT)), "a$b$")
@@ -0,0 +1,90 @@
+import collections
+import dataclasses
+from unittest import TestCase
+
+import pyhbs
+from pyhbs import hbs_compiler
+
+
+@dataclasses.dataclass
+class Address:
+    city: str
+
+
+@dataclasses.dataclass
+class Customer:
+    name: str
+    address: Address
+
+
+class Row:
+    __slots__ = ("number", "customer")
+
+    def __init__(self, number, customer):
+        self.number = number
+        self.customer = customer
+
+
+Point = collections.namedtuple("Point", "x y")
+
+
+class TestObjectContexts(TestCase):
+    def test_dataclass_context(self):
+        customer = Customer("Anas", Address("Hat Yai"))
+        self.assertEqual(
+            pyhbs.render_source("{{name}} / {{address.city}}", customer),
+            "Anas / Hat Yai")
+
+    def test_slots_objects_in_each(self):
+        rows = [Row(i, Customer("c%d" % i, Address("x"))) for i in range(3)]
+        self.assertEqual(pyhbs.render_source(
+            "{{#each rows}}{{number}}:{{customer.name}};{{/each}}", {"rows": rows}),
+            "0:c0;1:c1;2:c2;")
+
+    def test_namedtuple_by_name_and_index(self):
+        self.assertEqual(pyhbs.render_source(
+            "{{p.x}},{{p.y}},{{p.[1]}}", {"p": Point(3, 4)}), "3,4,4")
+        self.assertEqual(pyhbs.render_source(
+            "{{#with p}}{{x}}{{/with}}", {"p": Point(3, 4)}), "3")
+
+    def test_strategy_is_cached_per_class(self):
+        pyhbs.render_source("{{x}}", {"p": Point(1, 2)})
+        hbs_compiler._getter_for(Point)
+        self.assertIs(hbs_compiler._getters[Point], hbs_compiler._get_attribute)
+        self.assertIs(hbs_compiler._getters[list], hbs_compiler._get_index)
+
+    def test_dunder_attributes_are_hidden(self):
+        self.assertEqual(pyhbs.render_source(
+            "[{{c.__class__}}]", {"c": Address("x")}), "[]")
+
+    def test_private_attributes_and_methods_are_hidden(self):
+        class Account:
+            def __init__(self):
+                self.name = "a"
+                self._secret = "s"
+                self.deleted = False
+
+            def delete(self, *args):
+                self.deleted = True
+                return "deleted"
+
+            @property
+            def label(self):
+                return "L"
+
+        account = Account()
+        self.assertEqual(pyhbs.render_source(
+            "[{{o.name}}|{{o._secret}}|{{o.delete}}|{{o.label}}]", {"o": account}), "[a|||L]")
+        self.assertFalse(account.deleted)
+        self.assertEqual(pyhbs.render_source("{{#with o}}[{{_secret}}{{delete}}]{{/with}}",
+                                             {"o": account}), "[]")
+        self.assertFalse(account.deleted)
+
+    def test_callable_fields_are_data(self):
+        @dataclasses.dataclass
+        class Link:
+            url: str
+            render: object
+
+        link = Link("u", lambda this: "called")
+        self.assertEqual(pyhbs.render_source("{{l.url}} {{l.render}}", {"l": link}), "u called")
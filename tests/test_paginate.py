@@ -0,0 +1,37 @@
+from unittest import TestCase
+
+import pyhbs
+
+
+SOURCE = ('{{#paginate rows limit=2 offset=2 url="/list?q=1&offset=4"}}'
+          "{{#with paginate}}{{page_no}}/{{num_pages}} {{#each data}}{{this}}{{/each}}"
+          " {{{previous.url}}} {{{next.url}}}{{/with}}{{else}}empty{{/paginate}}")
+
+
+class LazyRows:
+    def __init__(self, total):
+        self.total = total
+        self.fetched = []
+
+    def count(self):
+        return self.total
+
+    def fetch(self, offset, limit):
+        self.fetched.append((offset, limit))
+        return list(range(offset, min(offset + limit, self.total)))
+
+
+class TestPaginate(TestCase):
+    def test_list(self):
+        self.assertEqual(pyhbs.render_source(SOURCE, {"rows": list(range(5))}),
+                         "2/3 23 /list?q=1&offset=0 /list?q=1&offset=4")
+
+    def test_lazy_source_fetches_one_page(self):
+        rows = LazyRows(5)
+        self.assertEqual(pyhbs.render_source(SOURCE, {"rows": rows}),
+                         "2/3 23 /list?q=1&offset=0 /list?q=1&offset=4")
+        self.assertEqual(rows.fetched, [(2, 2)])
+
+    def test_empty(self):
+        self.assertEqual(pyhbs.render_source(SOURCE, {"rows": []}), "empty")
+        self.assertEqual(pyhbs.render_source(SOURCE, {"rows": LazyRows(0)}), "empty")
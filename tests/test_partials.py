@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import pyhbs
+from pyhbs import hbs_compiler, template
+
+
+class TestPartials(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        pyhbs.clear_partials()
+
+    def tearDown(self):
+        pyhbs.clear_partials()
+        for key in list(template._template_cache):
+            if template._cache_path(key).startswith(self.dir):
+                del template._template_cache[key]
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, source):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as f:
+            f.write(source)
+        return path
+
+    def test_registered_source(self):
+        pyhbs.register_partial("greet", "Hi {{name}}!")
+        self.assertEqual(pyhbs.render_source("{{> greet}} {{> greet user}}",
+                                             {"name": "a", "user": {"name": "b"}}),
+                         "Hi a! Hi b!")
+
+    def test_partial_directory(self):
+        self._write("_row.hbs", "<td>{{name}}</td>")
+        page = self._write("page.hbs", "{{#each rows}}{{> row}}{{/each}}")
+        pyhbs.add_partial_dir(self.dir)
+        self.assertEqual(pyhbs.render_file(page, {"rows": [{"name": "x"}, {"name": "y"}]}),
+                         "<td>x</td><td>y</td>")
+
+    def test_compiled_once(self):
+        pyhbs.register_partial("p", "[{{this}}]")
+        first = pyhbs.get_partial("p")
+        self.assertIs(pyhbs.get_partial("p"), first)
+        pyhbs.register_partial("p", "({{this}})")
+        self.assertEqual(pyhbs.render_source("{{> p x}}", {"x": 1}), "(1)")
+
+    def test_explicit_partials_take_precedence(self):
+        pyhbs.register_partial("p", "registered")
+        override = pyhbs.compile_source("explicit").render
+        self.assertEqual(pyhbs.render_source("{{> p}}", {}, partials={"p": override}),
+                         "explicit")
+        page = self._write("page.hbs", "{{> p}}")
+        self.assertEqual(pyhbs.render_file(page, {}, partials={"p": override}), "explicit")
+
+    def test_missing_partial(self):
+        self.assertRaises(Exception, pyhbs.render_source, "{{> nope}}", {})
+
+
+class TestInlinePartials(TestPartials):
+    def compile(self, source):
+        return hbs_compiler.Compiler("html", template.partial_source).compile(source)
+
+    def test_inlined_partial_output(self):
+        pyhbs.register_partial("row", "<td>{{name}}{{#if ../flag}}!{{/if}}</td>")
+        source = "{{#each rows}}{{> row}}{{/each}}|{{> row first}}"
+        code = self.compile(source)
+        self.assertNotIn("get_partial('row')\n        scope", code.split("else:")[-1])
+        context = {"flag": True, "rows": [{"name": "x"}, {"name": "y"}], "first": {"name": "z"}}
+        expected = "<td>x</td><td>y</td>|<td>z!</td>"
+        self.assertEqual(pyhbs.render_source(source, context), expected)
+        # same output as calling the compiled partial
+        called = {"row": pyhbs.compile_source("<td>{{name}}{{#if ../flag}}!{{/if}}</td>").render}
+        self.assertEqual(pyhbs.render_source(source, context, partials=called), expected)
+
+    def test_plain_partial_needs_no_scope(self):
+        pyhbs.register_partial("plain", "<b>{{name}}</b>")
+        code = self.compile("{{> plain}}")
+        inlined = code.split("    else:\n", 1)[1]
+        self.assertNotIn("Scope(context, context)\n        result.grow(inner", inlined)
+        self.assertNotIn("inner(", inlined)
+
+    def test_recursion_is_not_inlined_forever(self):
+        pyhbs.register_partial("tree", "{{name}}{{#each children}}({{> tree}}){{/each}}")
+        context = {"name": "a", "children": [{"name": "b", "children": [{"name": "c"}]}]}
+        self.assertEqual(pyhbs.render_source("{{> tree}}", context), "a(b(c))")
+
+    def test_large_or_other_mode_partials_are_called(self):
+        pyhbs.register_partial("big", "x" * (hbs_compiler.Compiler.inline_max_size + 1))
+        pyhbs.register_partial("text", "{{a}}", autoescape="none")
+        code = self.compile("{{> big}}{{> text}}")
+        self.assertNotIn("if 'big' in partials", code)
+        self.assertNotIn("if 'text' in partials", code)
+        self.assertEqual(pyhbs.render_source("{{> text}}", {"a": "<"}), "<")
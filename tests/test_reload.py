@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+import pyhbs
+from pyhbs import reloader, template
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+class TestAutoReload(TestCase):
+    use_inotify = False
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "page.hbs")
+        self.other = os.path.join(self.dir, "other.hbs")
+        self._write(self.path, "v1 {{name}}")
+        self._write(self.other, "other {{name}}")
+        self.watcher = pyhbs.enable_auto_reload(interval=0.05,
+                                                use_inotify=self.use_inotify)
+
+    def tearDown(self):
+        pyhbs.disable_auto_reload()
+        template.invalidate(("file", self.path))
+        template.invalidate(("file", self.other))
+        shutil.rmtree(self.dir)
+
+    def _write(self, path, source):
+        with open(path, "w") as f:
+            f.write(source)
+
+    def test_changed_template_is_recompiled(self):
+        self.assertEqual(pyhbs.render_file(self.path, {"name": "a"}), "v1 a")
+        other = pyhbs.get_template(self.other)
+        self._write(self.path, "version 2 {{name}}")
+        self.assertTrue(_wait_for(
+            lambda: self.path not in template._template_cache))
+        self.assertEqual(pyhbs.render_file(self.path, {"name": "a"}),
+                         "version 2 a")
+        # untouched templates keep their compiled code
+        self.assertIs(pyhbs.get_template(self.other), other)
+
+    def test_cache_hit_does_not_stat(self):
+        pyhbs.get_template(self.path)
+        original = os.stat
+        calls = []
+        caller = threading.get_ident()
+        def counting_stat(*args, **kwargs):
+            if threading.get_ident() == caller:
+                calls.append(args)
+            return original(*args, **kwargs)
+        os.stat = counting_stat
+        try:
+            for i in range(100):
+                pyhbs.get_template(self.path)
+        finally:
+            os.stat = original
+        self.assertEqual(calls, [])
+
+    def test_disable(self):
+        pyhbs.get_template(self.path)
+        pyhbs.disable_auto_reload()
+        self._write(self.path, "version 3")
+        time.sleep(0.2)
+        self.assertIn(self.path, template._template_cache)
+
+    def test_missing_file(self):
+        path = os.path.join(self.dir, "missing", "page.hbs")
+        with self.assertRaisesRegex(Exception, "Failed to compile template"):
+            pyhbs.get_template(path)
+
+
+class TestAutoReloadInotify(TestAutoReload):
+    use_inotify = True
+
+    def test_unwatchable_directory_is_polled(self):
+        libc = reloader._load_libc()
+        if libc is None:
+            self.skipTest("inotify is not available")
+        changed = []
+        watcher = reloader.InotifyWatcher(changed.append, libc, interval=0.05)
+        watcher.start()
+        try:
+            path = os.path.join(self.dir, "later", "page.hbs")
+            watcher.watch(path)
+            os.mkdir(os.path.dirname(path))
+            self._write(path, "new")
+            self.assertTrue(_wait_for(lambda: changed == [path]))
+        finally:
+            watcher.stop()
@@ -0,0 +1,156 @@
+import dataclasses
+import json
+import os
+import shutil
+import tempfile
+import typing
+from unittest import TestCase
+
+import pyhbs
+from pyhbs import hbs_compiler, schema as schemas
+
+
+@dataclasses.dataclass
+class Line:
+    name: str
+    price: float
+
+
+@dataclasses.dataclass
+class Order:
+    title: str
+    lines: typing.List[Line]
+    note: typing.Optional[Line] = None
+
+
+ORDER_SCHEMA = {
+    "type": "object",
+    "required": ["title", "lines"],
+    "properties": {
+        "title": {"type": "string"},
+        "note": {"type": "object", "properties": {"name": {"type": "string"}}},
+        "lines": {"type": "array", "items": {
+            "type": "object",
+            "required": ["name", "price"],
+            "properties": {"name": {"type": "string"}, "price": {"type": "number"}},
+        }},
+    },
+}
+
+SOURCE = ("<h1>{{title}}</h1>{{note.name}}{{#each lines}}<td>{{name}}</td>"
+          "{{#if price}}{{price}}{{else}}-{{/if}}{{../title}}{{/each}}")
+EXPECTED = "<h1>T</h1>n<td>a</td>1T<td>b</td>-T"
+
+
+class TestSchema(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "order.hbs")
+        with open(self.path, "w") as f:
+            f.write(SOURCE)
+
+    def tearDown(self):
+        for key in list(pyhbs.template._template_cache):
+            if pyhbs.template._cache_path(key) == self.path:
+                del pyhbs.template._template_cache[key]
+        shutil.rmtree(self.dir)
+
+    def _dict_context(self):
+        return {"title": "T", "note": {"name": "n"},
+                "lines": [{"name": "a", "price": 1}, {"name": "b", "price": 0}]}
+
+    def test_json_schema(self):
+        code = hbs_compiler.Compiler(schema=ORDER_SCHEMA).compile(SOURCE)
+        self.assertIn("value = ctx['title']", code)
+        self.assertIn("        return ctx['lines']\n", code)
+        self.assertIn("        return ctx['price']\n", code)
+        self.assertEqual(pyhbs.render_file(self.path, self._dict_context(), schema=ORDER_SCHEMA),
+                         EXPECTED)
+
+    def test_dataclass(self):
+        code = hbs_compiler.Compiler(schema=Order).compile(SOURCE)
+        self.assertIn("        return ctx.lines\n", code)
+        order = Order("T", [Line("a", 1), Line("b", 0)], Line("n", 2))
+        self.assertEqual(pyhbs.render_file(self.path, order, schema=Order), EXPECTED)
+        self.assertEqual(pyhbs.render_file(self.path, Order("T", [])), "<h1>T</h1>")
+        self.assertEqual(pyhbs.render_file(self.path, Order("T", []), schema=Order), "<h1>T</h1>")
+
+    def test_guard_falls_back(self):
+        order = Order("T", [Line("a", 1), Line("b", 0)], Line("n", 2))
+        self.assertEqual(pyhbs.render_file(self.path, order, schema=ORDER_SCHEMA), EXPECTED)
+        self.assertEqual(pyhbs.render_file(self.path, Order(None, []), schema=ORDER_SCHEMA),
+                         "<h1></h1>")
+        # contexts of the declared type that don't match the schema render
+        # like the generic template
+        broken = []
+        context = self._dict_context()
+        del context["title"]
+        broken.append(context)
+        context = self._dict_context()
+        del context["lines"][1]["name"]
+        broken.append(context)
+        context = self._dict_context()
+        context["lines"][0] = None
+        broken.append(context)
+        for context in broken:
+            self.assertEqual(pyhbs.render_file(self.path, context, schema=ORDER_SCHEMA),
+                             pyhbs.render_file(self.path, context))
+
+    def test_nested_required_fields(self):
+        schema = {"type": "object", "required": ["a"], "properties": {
+            "a": {"type": "object", "required": ["b"], "properties": {"b": {"type": "string"}}}}}
+        with open(self.path, "w") as f:
+            f.write("[{{a.b}}]")
+        for context, expected in (({"a": None}, "[]"), ({"a": {"c": 1}}, "[]"),
+                                  ({"a": {"b": "x"}}, "[x]"), ({}, "[]")):
+            self.assertEqual(pyhbs.render_file(self.path, context, schema=schema), expected)
+
+    def test_fallback_does_not_render_twice(self):
+        schema = {"type": "object", "required": ["a"], "properties": {
+            "a": {"type": "object", "required": ["b"], "properties": {"b": {"type": "string"}}}}}
+        with open(self.path, "w") as f:
+            f.write("{{#each rows}}{{count this}},{{/each}}[{{a.b}}]")
+        calls = []
+        pyhbs.register_helper("count", lambda this, value: calls.append(str(value)) or value)
+        try:
+            for use_schema in (schema, None):
+                rows = (row for row in ("x", "y"))
+                self.assertEqual(pyhbs.render_file(self.path, {"rows": rows, "a": {}},
+                                                   schema=use_schema), "x,y,[]")
+        finally:
+            pyhbs.hbs_compiler.get_helpers().pop("count")
+        self.assertEqual(calls, ["x", "y", "x", "y"])
+
+    def test_helpers_win(self):
+        # compiled before the helper exists, dropped when it is registered
+        for schema in (ORDER_SCHEMA, None):
+            self.assertEqual(pyhbs.render_file(self.path, self._dict_context(),
+                                               schema=schema)[:14], "<h1>T</h1>n<td")
+        pyhbs.register_helper("title", lambda this: "helper")
+        try:
+            for schema in (ORDER_SCHEMA, None):
+                self.assertEqual(pyhbs.render_file(self.path, self._dict_context(),
+                                                   schema=schema)[:19],
+                                 "<h1>helper</h1>n<td")
+        finally:
+            pyhbs.hbs_compiler.get_helpers().pop("title")
+
+    def test_cached_per_schema(self):
+        generic = pyhbs.get_template(self.path)
+        typed = pyhbs.get_template(self.path, schema=ORDER_SCHEMA)
+        self.assertIsNot(generic, typed)
+        self.assertIs(pyhbs.get_template(self.path, schema=ORDER_SCHEMA), typed)
+        self.assertEqual(pyhbs.get_template(self.path, schema=Order).schema_types, (Order, Line))
+        # equal schemas built on every call share one entry
+        cached = len(pyhbs.template._template_cache)
+        for i in range(5):
+            self.assertIs(pyhbs.get_template(self.path, schema=json.loads(json.dumps(ORDER_SCHEMA))),
+                          typed)
+            self.assertIs(pyhbs.get_template(self.path, schema=json.dumps(ORDER_SCHEMA)), typed)
+        self.assertEqual(len(pyhbs.template._template_cache), cached)
+
+    def test_schema_from_dataclass(self):
+        schema = schemas.as_schema(Order)
+        self.assertEqual(schema.fields["note"][1], False)
+        self.assertEqual(schema.resolve(["lines"]).items.cls, Line)
+        self.assertEqual(schemas.access(schema, ["note", "name"], "ctx"), ("ctx.note", ["name"]))
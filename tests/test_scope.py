@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+import pyhbs
+from pyhbs.hbs_compiler import Scope
+
+
+def _flagged(this, options, context):
+    return options['fn'](Scope(context, this, {"flag": "on"}))
+
+
+class TestScope(TestCase):
+    def setUp(self):
+        pyhbs.register_helper("flagged", _flagged)
+
+    def test_slots(self):
+        scope = Scope({"a": 1}, None)
+        self.assertFalse(hasattr(scope, "__dict__"))
+        self.assertEqual(scope.get("a"), 1)
+        self.assertEqual(scope.get("b", 2), 2)
+        self.assertIs(scope.root, scope.context)
+
+    def test_data_does_not_leak_into_siblings(self):
+        out = pyhbs.render_source(
+            "{{#flagged obj}}[{{@flag}}]{{/flagged}}[{{@flag}}]", {"obj": {"a": 1}})
+        self.assertEqual(out, "[on][]")
+
+    def test_child_data_shadows_parent(self):
+        outer = Scope({}, {}, {"x": 1, "y": 2})
+        inner = Scope({}, outer, {"x": 3})
+        self.assertEqual(inner.data.get("x"), 3)
+        self.assertEqual(inner.data.get("y"), 2)
+        self.assertEqual(outer.data.get("x"), 1)
+
+    def test_root_and_parent_in_nested_each(self):
+        source = ("{{#each groups}}{{#each items}}"
+                  "{{name}}:{{../label}}:{{@root.settings.locale}}:{{@lang}};"
+                  "{{/each}}{{/each}}")
+        context = {
+            "settings": {"locale": "th"},
+            "groups": [{"label": "g1", "items": [{"name": "a"}, {"name": "b"}]}],
+        }
+        self.assertEqual(pyhbs.render_source(source, context, data={"lang": "en"}),
+                         "a:g1:th:en;b:g1:th:en;")
+
+    def test_parent_of_top_level(self):
+        self.assertEqual(pyhbs.render_source("[{{../../x}}]", {"x": 1}), "[]")
@@ -0,0 +1,38 @@
+from unittest import TestCase
+
+import pyhbs
+from pyhbs import hbs_compiler, template
+
+
+class TestSourceCache(TestCase):
+    def setUp(self):
+        pyhbs.clear_source_cache()
+
+    def tearDown(self):
+        pyhbs.set_source_cache_size(256)
+        pyhbs.clear_source_cache()
+
+    def test_repeat_compile_is_cached(self):
+        tmpl = pyhbs.compile_source("Hello {{name}}")
+        self.assertIs(pyhbs.compile_source("Hello {{name}}"), tmpl)
+        self.assertIsNot(pyhbs.compile_source("Bye {{name}}"), tmpl)
+
+    def test_render_source_skips_parsing(self):
+        self.assertEqual(pyhbs.render_source("Hi {{name}}", {"name": "a"}), "Hi a")
+        original = hbs_compiler.Compiler.compile
+        def fail(self, source):
+            raise AssertionError("compiled twice")
+        hbs_compiler.Compiler.compile = fail
+        try:
+            self.assertEqual(pyhbs.render_source("Hi {{name}}", {"name": "b"}), "Hi b")
+        finally:
+            hbs_compiler.Compiler.compile = original
+
+    def test_cache_is_bounded(self):
+        pyhbs.set_source_cache_size(2)
+        first = pyhbs.compile_source("1")
+        pyhbs.compile_source("2")
+        pyhbs.compile_source("1")
+        pyhbs.compile_source("3")
+        self.assertEqual(len(template._source_cache), 2)
+        self.assertIs(pyhbs.compile_source("1"), first)
@@ -0,0 +1,91 @@
+from unittest import TestCase
+
+import pyhbs
+from pyhbs import hbs_compiler
+
+
+class TestSpecialise(TestCase):
+    def setUp(self):
+        self.hook_calls = []
+        # hooks are applied by the compiler only
+        pyhbs.default_environment.interpret_renders = 0
+
+    def tearDown(self):
+        pyhbs.default_environment.interpret_renders = 2
+        for name in ("fmt", "shout"):
+            pyhbs.hbs_compiler.get_helpers().pop(name, None)
+            pyhbs.hbs_compiler.get_specialisers().pop(name, None)
+
+    def test_compare_operators(self):
+        source = '{{#compare a b "%s"}}y{{else}}n{{/compare}}'
+        context = {"a": 1, "b": 2}
+        for op, expected in (("=", "n"), ("!=", "y"), ("<", "y"), (">", "n"),
+                             ("<=", "y"), (">=", "n")):
+            self.assertEqual(pyhbs.render_source(source % op, context), expected, op)
+        self.assertEqual(pyhbs.render_source('{{#compare a b "in"}}y{{/compare}}',
+                                             {"a": 1, "b": [1]}), "y")
+        # generic path, operator from the context
+        self.assertEqual(pyhbs.render_source("{{#compare a b op}}y{{else}}n{{/compare}}",
+                                             {"a": 1, "b": 2, "op": "!="}), "y")
+        self.assertRaises(Exception, pyhbs.render_source,
+                          '{{#compare a b "~"}}y{{/compare}}', context)
+
+    def test_ifeq_and_if_match(self):
+        self.assertEqual(pyhbs.render_source('{{#ifeq 1 1}}y{{/ifeq}}{{#ifeq 1 2}}y{{else}}n{{/ifeq}}', {}),
+                         "yn")
+        source = '{{#each rows}}{{#if_match name "ab%"}}[{{name}}]{{/if_match}}{{/each}}'
+        rows = [{"name": name} for name in ("abc", "b", None, "ab")]
+        self.assertEqual(pyhbs.render_source(source, {"rows": rows}),
+                         "[abc][ab]")
+
+    def test_invalid_pattern_is_not_specialised(self):
+        source = '{{#if flag}}{{#if_match name "a("}}y{{/if_match}}{{/if}}ok'
+        env = pyhbs.Environment(interpret_renders=0)
+        self.assertEqual(env.render_source(source, {"flag": False, "name": "a"}), "ok")
+        self.assertRaises(Exception, env.render_source, source, {"flag": True, "name": "a"})
+
+    def test_failing_hook_is_not_specialised(self):
+        env = pyhbs.Environment(interpret_renders=0)
+        for source in ('{{#if x}}{{#ifeq "a"}}A{{/ifeq}}{{/if}}ok',
+                       '{{#if x}}{{#compare a "b" op="="}}A{{/compare}}{{/if}}ok'):
+            self.assertEqual(env.render_source(source, {"x": False}), "ok")
+            self.assertRaises(Exception, env.render_source, source, {"x": True, "a": "b"})
+
+    def test_specialised_call_site(self):
+        code = hbs_compiler.Compiler().compile('{{#if_match name "a%"}}y{{/if_match}}')
+        self.assertIn("_special0 = specialise_helper(helpers, specialisers, 'if_match', (DYNAMIC, 'a%'), {})", code)
+        self.assertIn("if helper is _special0[0]:", code)
+        code = hbs_compiler.Compiler().compile("{{#if_match name pattern}}y{{/if_match}}")
+        self.assertNotIn("_special", code)
+
+    def _hook(self, *args, **kwargs):
+        self.hook_calls.append((args, kwargs))
+        sep = kwargs.get("sep", "-")
+        if sep is hbs_compiler.DYNAMIC:
+            return None
+        return lambda this, value, **kwargs: "special%s%s" % (sep, value)
+
+    def test_custom_hook(self):
+        pyhbs.register_helper("fmt", lambda this, value, sep="-": "generic%s%s" % (sep, value),
+                              specialise=self._hook)
+        self.assertEqual(pyhbs.render_source('{{fmt a sep=":"}} {{fmt a sep=s}} {{fmt a}}',
+                                             {"a": 1, "s": "+"}),
+                         "special:1 generic+1 generic-1")
+        self.assertIn(((hbs_compiler.DYNAMIC,), {"sep": ":"}), self.hook_calls)
+        # re-registering without a hook drops the specialisation
+        pyhbs.register_helper("fmt", lambda this, value, sep="-": "plain%s%s" % (sep, value))
+        self.assertEqual(pyhbs.render_source('{{fmt a sep=":"}}', {"a": 1}), "plain:1")
+
+    def test_render_time_helpers_win(self):
+        pyhbs.register_helper("shout", lambda this, value: "generic", specialise=self._hook)
+        tmpl = pyhbs.compile_source('{{shout "x"}}')
+        scope = pyhbs.Scope({}, None)
+        self.assertEqual("".join(tmpl.render(scope)), "special-x")
+        own = {"shout": lambda this, value: value.upper()}
+        self.assertEqual("".join(tmpl.render(scope, helpers=own)), "X")
+
+    def test_environment_hooks(self):
+        env = pyhbs.Environment(helpers={"fmt": lambda this, value, sep="-": "generic"},
+                                specialisers={"fmt": self._hook}, interpret_renders=0)
+        self.assertEqual(env.render_source('{{fmt 2 sep="/"}}', {}), "special/2")
+        self.assertEqual(pyhbs.render_source('{{#compare 1 2 "<"}}y{{/compare}}', {}), "y")
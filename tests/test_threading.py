@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+import pyhbs
+from pyhbs import hbs_compiler, template
+
+
+def _run_threads(target, count):
+    errors = []
+    barrier = threading.Barrier(count)
+    def run(i):
+        try:
+            barrier.wait()
+            target(i)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+class TestConcurrentCompile(TestCase):
+    def test_compilers_do_not_share_state(self):
+        expected = {}
+        for i in range(16):
+            source = "<%d>{{#each items}}{{name}}-%d{{/each}}{{#if x}}%d{{/if}}" % (i, i, i)
+            expected[i] = hbs_compiler.Compiler().compile(source)
+        def compile_many(i):
+            for n in range(5):
+                k = (i + n) % 16
+                source = "<%d>{{#each items}}{{name}}-%d{{/each}}{{#if x}}%d{{/if}}" % (k, k, k)
+                code = hbs_compiler.Compiler().compile(source)
+                if code != expected[k]:
+                    raise AssertionError("corrupted output for template %d" % k)
+        self.assertEqual(_run_threads(compile_many, 16), [])
+
+
+class TestSingleFlight(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(4):
+            path = os.path.join(self.dir, "t%d.hbs" % i)
+            with open(path, "w") as f:
+                f.write("template %d {{name}}" % i)
+            self.paths.append(path)
+
+    def tearDown(self):
+        for path in self.paths:
+            template._template_cache.pop(path, None)
+        shutil.rmtree(self.dir)
+
+    def test_one_compile_per_template(self):
+        compiled = []
+        env = template.default_environment
+        original = env._load_template
+        def counting_load(file_path, *args):
+            compiled.append(file_path)
+            return original(file_path, *args)
+        env._load_template = counting_load
+        results = {}
+        def render(i):
+            path = self.paths[i % len(self.paths)]
+            results[i] = pyhbs.render_file(path, {"name": i})
+        try:
+            errors = _run_threads(render, 32)
+        finally:
+            del env._load_template
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(compiled), sorted(self.paths))
+        for i, output in results.items():
+            self.assertEqual(output, "template %d %d" % (i % 4, i))
@@ -0,0 +1,72 @@
+import dataclasses
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import pyhbs
+
+
+@dataclasses.dataclass
+class Row:
+    name: str
+    price: int
+
+
+class TestTiering(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "rows.hbs")
+        with open(self.path, "w") as f:
+            f.write("{{title}}:{{#each rows}}[{{name}}={{price}}{{../title}}]{{/each}}")
+        self.env = pyhbs.Environment(tiering=True, tier_threshold=3, tier_samples=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _render(self, context):
+        return self.env.render_file(self.path, context)
+
+    def test_tiers(self):
+        context = {"title": "t", "rows": [{"name": "a", "price": 1}, {"name": "b", "price": 2}]}
+        expected = "t:[a=1t][b=2t]"
+        for i in range(3):
+            self.assertEqual(self._render(context), expected)
+        self.assertEqual(self.env.tier_info(self.path)["tier"], "generic")
+        self.assertEqual(self._render(context), expected)
+        self.assertEqual(self.env.tier_info(self.path)["tier"], "sampling")
+        self.assertEqual(self._render(context), expected)
+        generic = self.env.get_template(self.path)
+        special = generic.tier.special
+        self.assertIsNot(special, generic)
+        self.assertEqual(self._render(context), expected)
+        info = self.env.tier_info(self.path)
+        self.assertEqual(info["tier"], "specialised")
+        self.assertEqual((info["renders"], info["specialised_renders"]), (6, 1))
+        # one render function and two rows, all on the fast path
+        self.assertEqual(info["guards"], {"typed": 3, "generic": 0})
+
+    def test_deoptimises_on_other_shapes(self):
+        context = {"title": "t", "rows": [{"name": "a", "price": 1}]}
+        for i in range(5):
+            self._render(context)
+        self.assertEqual(self.env.tier_info(self.path)["tier"], "specialised")
+        # dataclass rows, and a key that was never seen
+        other = {"title": "u", "rows": [Row("x", 2), {"name": "y", "price": 3}]}
+        self.assertEqual(self._render(other), "u:[x=2u][y=3u]")
+        self.assertEqual(self._render({"rows": [{"name": "z"}]}), ":[z=]")
+        self.assertEqual(self.env.tier_info(self.path)["guards"], {"typed": 4, "generic": 1})
+
+    def test_unsupported_context_stays_generic(self):
+        for i in range(6):
+            self.assertEqual(self._render([1]), ":")
+        self.assertEqual(self.env.tier_info(self.path)["tier"], "generic")
+
+    def test_invalidation_restarts(self):
+        context = {"title": "t", "rows": []}
+        for i in range(5):
+            self._render(context)
+        self.env.invalidate(("file", self.path))
+        self._render(context)
+        self.assertEqual(self.env.tier_info(self.path)["renders"], 1)
+        self.assertIsNone(pyhbs.tier_info(self.path))
@@ -0,0 +1,59 @@
+import gc
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import pyhbs
+from pyhbs import template
+
+
+class TestWarmup(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, "sub"))
+        self.good = [os.path.join(self.dir, "a.hbs"),
+                     os.path.join(self.dir, "sub", "b.hbs")]
+        self.bad = os.path.join(self.dir, "broken.hbs")
+        for i, path in enumerate(self.good):
+            self._write(path, "page %d {{name}}" % i)
+        self._write(self.bad, "{{#if x}}mismatched{{/each}}")
+        self._write(os.path.join(self.dir, "notes.txt"), "{{ignored}}")
+
+    def tearDown(self):
+        for path in self.good + [self.bad]:
+            template._template_cache.pop(path, None)
+        shutil.rmtree(self.dir)
+
+    def _write(self, path, source):
+        with open(path, "w") as f:
+            f.write(source)
+
+    def _check(self, workers):
+        report = pyhbs.warmup(self.dir, workers=workers)
+        self.assertEqual(sorted(report["compiled"]), sorted(self.good))
+        self.assertEqual(list(report["failed"]), [self.bad])
+        for path in self.good:
+            self.assertIn(path, template._template_cache)
+            self.assertGreaterEqual(report["compiled"][path], 0)
+        self.assertEqual(pyhbs.render_file(self.good[1], {"name": "x"}), "page 1 x")
+
+    def test_serial(self):
+        self._check(workers=1)
+
+    def test_process_pool(self):
+        self._check(workers=2)
+
+
+class TestFreeze(TestWarmup):
+    def tearDown(self):
+        if hasattr(gc, "unfreeze"):
+            gc.unfreeze()
+        TestWarmup.tearDown(self)
+
+    def test_freeze_templates(self):
+        report = pyhbs.freeze_templates(self.dir, workers=1)
+        self.assertEqual(sorted(report["compiled"]), sorted(self.good))
+        if hasattr(gc, "get_freeze_count"):
+            self.assertGreater(gc.get_freeze_count(), 0)
+        self.assertEqual(pyhbs.render_file(self.good[0], {"name": "x"}), "page 0 x")